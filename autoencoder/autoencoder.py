@@ -1,16 +1,8 @@
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
 import tensorflow as tf
-import tensorflow_datasets as tfds
 
-from sklearn.metrics import accuracy_score, precision_score, recall_score
-from tensorflow.keras import layers, losses
-from tensorflow.keras.datasets import fashion_mnist
+from tensorflow.keras import layers
 from tensorflow.keras.models import Model
 
-import visualize
-
 
 class Autoencoder(Model):
     def __init__(self, latent_dim, image_shape, num_labels, freeze=False):
@@ -0,0 +1,221 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import config
+from neighbors import LatentIndex
+from preprocess import get_data, to_numpy, preprocess_data, unlabel_data, reconstruction_pairs
+
+pipelines = ("numpy", "dataset", "shards")
+# The modules whose cold import time is benchmarked, with the heavy dependencies they are allowed to load
+entry_points = {
+    "config": (),
+    "shards": (),
+    "preprocess": (),
+    "visualize": (),
+    "latent": (),
+    "neighbors": (),
+    "main": (),
+    "benchmarks": (),
+    "autoencoder": ("tensorflow",),
+    "neural_network": ("tensorflow",),
+}
+heavy_dependencies = ("tensorflow", "tensorflow_datasets", "pandas", "sklearn", "matplotlib")
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def benchmark_pipeline(pipeline, epochs=1):
+    # Trains the autoencoder on the training data of config.py, either from arrays made with to_numpy,
+    # the way main.py used to, streamed from the batched dataset, or streamed from the shard store.
+    # The images per second include making the arrays.
+    from tensorflow.keras import losses
+
+    from autoencoder import Autoencoder
+
+    shard_directory = config.shard_directory if pipeline == "shards" else None
+    (ds_train, _), _ = get_data(config.name_of_dataset, config.train_test_split, shard_directory)
+    autoencoder = Autoencoder(latent_dim=config.latent_vector_size, image_shape=(28, 28), num_labels=10)
+    autoencoder.compile(optimizer=config.optimizer, loss=losses.MeanSquaredError())
+    start = time.perf_counter()
+    if pipeline == "numpy":
+        x_train = to_numpy(unlabel_data(preprocess_data(ds_train)))
+        autoencoder.fit(x_train, x_train, epochs=epochs, batch_size=config.batch_size, shuffle=True, verbose=0)
+    elif pipeline in ("dataset", "shards"):
+        train_data = reconstruction_pairs(preprocess_data(ds_train, shuffle=True, batch=True,
+                                                          batch_size=config.batch_size,
+                                                          shuffle_buffer_size=config.shuffle_buffer_size))
+        autoencoder.fit(train_data, epochs=epochs, verbose=0)
+    else:
+        raise ValueError("Unknown pipeline: {}".format(pipeline))
+    elapsed = time.perf_counter() - start
+    return {
+        "pipeline": pipeline,
+        "images_per_second": len(ds_train) * epochs / elapsed,
+        "peak_rss": peak_rss(),
+    }
+
+
+def compare_pipelines(epochs=1):
+    # Every pipeline is run in a process of its own, so their peak RSS is not mixed up
+    results = []
+    for pipeline in pipelines:
+        output = subprocess.run([sys.executable, __file__, "pipeline", pipeline, str(epochs)], check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+def clustered_codes(size, dimension=64, clusters=100, seed=0):
+    # A stand-in for latent codes: a mixture of gaussians
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)) * 3
+    return (centers[rng.integers(clusters, size=size)] + rng.standard_normal((size, dimension))).astype(np.float32)
+
+
+def best_time(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_neighbors(codes=None, num_queries=256, k=10, probes=(1, 2, 4, 8, 16), repeat=3):
+    # The recall of the k nearest neighbors and the search time per query of the exact and the approximate
+    # search of LatentIndex, against brute force: all the distances at once, fully sorted. Without codes,
+    # 100000 clustered 64 dimensional codes stand in for the codes of a dataset.
+    codes = clustered_codes(100000) if codes is None else np.ascontiguousarray(codes, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = codes[rng.choice(len(codes), num_queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    def brute_force():
+        distances = (queries ** 2).sum(1)[:, np.newaxis] - 2 * queries @ codes.T + (codes ** 2).sum(1)
+        return np.argsort(distances, axis=1)[:, :k]
+
+    seconds, truth = best_time(brute_force, repeat)
+    results = [("brute force", seconds / num_queries, 1.0)]
+    index = LatentIndex(codes)
+
+    def recall(found):
+        return np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, truth)])
+
+    seconds, (_, found) = best_time(lambda: index.search(queries, k), repeat)
+    results.append(("exact", seconds / num_queries, recall(found)))
+    build_seconds, _ = best_time(index.build_partitions, 1)
+    results.append(("build {} partitions, total".format(len(index.centroids)), build_seconds, None))
+    for num_probes in probes:
+        seconds, (_, found) = best_time(lambda: index.search(queries, k, num_probes), repeat)
+        results.append(("{} probes".format(num_probes), seconds / num_queries, recall(found)))
+    return results
+
+
+def import_time(module, repeat=5):
+    # Imports the module in fresh interpreters with -X importtime. Returns the best cumulative import time
+    # in seconds, the heavy dependencies it loaded and the error when the import fails, then the time is None.
+    best = float("inf")
+    loaded = set()
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        stderr = process.stderr
+        if process.returncode != 0:
+            # The last line of the traceback is the exception, e.g. ModuleNotFoundError: No module named ...
+            lines = [line for line in stderr.splitlines() if line.strip() and not line.startswith("import time:")]
+            return None, [], lines[-1] if lines else "exit status {}".format(process.returncode)
+        # The lines are "import time: self [us] | cumulative | imported package", nested imports indented
+        for line in stderr.splitlines():
+            fields = line[len("import time:"):].split("|")
+            if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            if name.split(".")[0] in heavy_dependencies:
+                loaded.add(name.split(".")[0])
+            if name == module:
+                best = min(best, int(fields[1]) / 1e6)
+    return best, sorted(loaded), None
+
+
+def benchmark_imports(repeat=5):
+    results = {}
+    for module in entry_points:
+        seconds, loaded, error = import_time(module, repeat)
+        results[module] = {"seconds": seconds, "heavy_dependencies": loaded, "error": error}
+    return results
+
+
+def import_regressions(results, baseline=None, threshold=0.5, slack=0.02):
+    # A module regresses when it loads a heavy dependency it is not allowed to, or when it imports threshold
+    # slower than in the baseline and at least slack seconds slower, a few milliseconds of startup are noise.
+    # A module that fails to import is a regression too.
+    regressions = []
+    for module, result in results.items():
+        if result.get("error") is not None:
+            regressions.append("{} fails to import: {}".format(module, result["error"]))
+            continue
+        for dependency in result["heavy_dependencies"]:
+            if dependency not in entry_points[module]:
+                regressions.append("{} loads {}".format(module, dependency))
+        if baseline is not None and baseline.get(module, {}).get("seconds") is not None:
+            before, after = baseline[module]["seconds"], result["seconds"]
+            if after > before * (1 + threshold) and after - before > slack:
+                regressions.append("{} imports in {:.1f} ms, {:.1f} ms before".format(module, after * 1000,
+                                                                                      before * 1000))
+    return regressions
+
+
+if __name__ == '__main__':
+    # python benchmarks.py pipeline numpy|dataset|shards [epochs]  runs one pipeline and prints its result as JSON
+    # python benchmarks.py [epochs]                                compares the input pipelines
+    # python benchmarks.py imports [results.json [baseline.json]]   times the cold imports of the entry points,
+    #                                                               exits with 1 on regressions
+    # python benchmarks.py neighbors                                recall and latency of the latent index
+    if len(sys.argv) > 1 and sys.argv[1] == "pipeline":
+        print(json.dumps(benchmark_pipeline(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1)))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "imports":
+        results = benchmark_imports()
+        print("{:<16} {:>12}  {}".format("module", "import (ms)", "heavy dependencies"))
+        for module, result in results.items():
+            if result["error"] is not None:
+                print("{:<16} {:>12}  {}".format(module, "failed", result["error"]))
+                continue
+            print("{:<16} {:>12.1f}  {}".format(module, result["seconds"] * 1000,
+                                               ", ".join(result["heavy_dependencies"])))
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], "w") as file:
+                json.dump(results, file, indent=4)
+        baseline = None
+        if len(sys.argv) > 3:
+            with open(sys.argv[3]) as file:
+                baseline = json.load(file)
+        regressions = import_regressions(results, baseline)
+        for regression in regressions:
+            print("Regression: " + regression)
+        sys.exit(1 if regressions else 0)
+    if len(sys.argv) > 1 and sys.argv[1] == "neighbors":
+        print("Nearest 10 of 256 queries in 100000 clustered codes of 64 dimensions")
+        print("{:<24} {:>14} {:>8}".format("search", "ms per query", "recall"))
+        for name, seconds, search_recall in benchmark_neighbors():
+            print("{:<24} {:>14.3f} {:>8}".format(name, seconds * 1000,
+                                                  "" if search_recall is None else "{:.3f}".format(search_recall)))
+        sys.exit(0)
+
+    epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print("Training input pipeline, {}, {} epoch(s)".format(config.name_of_dataset, epochs))
+    print("{:<10} {:>12} {:>16}".format("pipeline", "images/s", "peak RSS (MB)"))
+    for result in compare_pipelines(epochs):
+        print("{:<10} {:>12.1f} {:>16.1f}".format(result["pipeline"], result["images_per_second"],
+                                                  result["peak_rss"] / 2 ** 20))
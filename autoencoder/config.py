@@ -1,6 +1,9 @@
 # Name of dataset
-# Possible datasets: mnist, mnist_fashion, cats_vs_dogs, cars196
+# Possible datasets: mnist, mnist_fashion, cats_vs_dogs, cars196, synthetic
 name_of_dataset = "fashion_mnist"
+# The dataset is written to memory-mapped shards in this directory the first time and read from them after,
+# None loads it with tensorflow_datasets every run
+shard_directory = "shards"
 
 learning_rate = 0.001
 loss_function = "mse"
@@ -10,13 +13,27 @@ freeze_weights = True
 
 epochs = 10
 train_test_split = 0.7
+# The training data is streamed in batches, shuffled every epoch through a buffer of this many images
+batch_size = 32
+shuffle_buffer_size = 10000
 number_of_reconstructions = 10
 tSNE_plots = False
+# Every tsne_every epochs a t-SNE plot of the latent codes of the test set is made in the background,
+# from a stratified sample of tsne_sample_size, with the codes reduced by PCA first. The embeddings are cached
+# in tsne_cache_directory per checkpoint.
+tsne_every = 5
+tsne_sample_size = 5000
+tsne_pca_components = 50
+tsne_perplexity = 30.0
+tsne_cache_directory = "embeddings"
+tsne_plot_path = "plots/latent-space-epoch-{}.png"
+
+image_size = 28 * 28
 
 neural_network =[
     {
         'type': 'input',
-        'size': num_bits
+        'size': image_size
     },
     {
         'type': 'dense',
@@ -27,7 +44,7 @@ neural_network =[
     },
     {
         'type': 'dense',
-        'size': num_bits,
+        'size': image_size,
         'activation': 'relu',
         'learning_rate': 0.001
     }
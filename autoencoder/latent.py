@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+from threading import Thread
+
+import numpy as np
+
+import visualize
+from shards import ShardedSplit
+
+# sklearn is imported by embed, the only function that uses it
+
+
+def encode_dataset(encoder, data, batch_size=1024, index=None):
+    """Encodes a ShardedSplit, or a tf.data.Dataset of normalized (images, labels) batches, with the encoder.
+    Returns the codes as one contiguous float32 matrix and the labels. index selects the rows of a ShardedSplit,
+    only those are read and encoded."""
+    if isinstance(data, ShardedSplit):
+        index = np.arange(len(data)) if index is None else np.asarray(index)
+        batches = (data.take(index[start:start + batch_size]) for start in range(0, len(index), batch_size))
+    elif index is not None:
+        raise ValueError("Rows can only be selected from a ShardedSplit")
+    else:
+        batches = data
+    codes, labels = [], []
+    for images, batch_labels in batches:
+        codes.append(np.asarray(encoder(images, training=False), dtype=np.float32))
+        labels.append(np.asarray(batch_labels))
+    return np.ascontiguousarray(np.concatenate(codes)), np.concatenate(labels)
+
+
+def stratified_sample(labels, size, seed=0):
+    """Returns the sorted indices of about size samples, with every label as frequent as in labels."""
+    rng = np.random.default_rng(seed)
+    classes, counts = np.unique(labels, return_counts=True)
+    index = []
+    for label, count in zip(classes, counts):
+        members = np.flatnonzero(labels == label)
+        index.append(rng.choice(members, min(count, int(round(size * count / len(labels)))), replace=False))
+    return np.sort(np.concatenate(index))
+
+
+def weights_digest(model):
+    # Identifies the checkpoint of the model by its weights
+    digest = hashlib.sha1()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+
+def embed(codes, pca_components=50, perplexity=30.0, seed=0):
+    """Reduces the codes to pca_components dimensions with PCA, which makes t-SNE much cheaper on wide codes,
+    and embeds them in 2d with t-SNE."""
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+
+    if pca_components is not None and pca_components < codes.shape[1]:
+        codes = PCA(n_components=pca_components, random_state=seed).fit_transform(codes)
+    return TSNE(n_components=2, perplexity=perplexity, init="pca", random_state=seed).fit_transform(codes)
+
+
+def embedding_cache_path(encoder, data, cache_directory, sample_size=None, pca_components=50, perplexity=30.0,
+                         seed=0):
+    # The embedding is keyed by the weights of the encoder, its checkpoint, and the parameters
+    parameters = [len(data), sample_size, pca_components, perplexity, seed]
+    key = hashlib.sha1((weights_digest(encoder) + json.dumps(parameters)).encode()).hexdigest()
+    return os.path.join(cache_directory, "embedding-{}.npz".format(key))
+
+
+def encode_sample(encoder, data, sample_size=None, seed=0):
+    """Encodes a stratified sample of sample_size, from a ShardedSplit only the sampled images are encoded."""
+    if sample_size is None or sample_size >= len(data):
+        return encode_dataset(encoder, data)
+    if isinstance(data, ShardedSplit):
+        return encode_dataset(encoder, data, index=stratified_sample(data.all_labels(), sample_size, seed))
+    codes, labels = encode_dataset(encoder, data)
+    index = stratified_sample(labels, sample_size, seed)
+    return codes[index], labels[index]
+
+
+def cached_embedding(codes, labels, cache_path=None, pca_components=50, perplexity=30.0, seed=0):
+    # Loads the embedding from cache_path when it exists, else embeds the codes and saves it there
+    if cache_path is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cached["embedding"], cached["labels"]
+    embedding = embed(codes, pca_components, perplexity, seed)
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        np.savez(cache_path, embedding=embedding, labels=labels)
+    return embedding, labels
+
+
+def sample_to_embed(encoder, data, sample_size=None, pca_components=50, perplexity=30.0, seed=0,
+                    cache_directory=None):
+    # The codes and labels of the sample and the cache path of their embedding. The codes and labels are None
+    # when the embedding is cached already, then the sample is not encoded.
+    cache_path = None
+    if cache_directory is not None:
+        cache_path = embedding_cache_path(encoder, data, cache_directory, sample_size, pca_components,
+                                          perplexity, seed)
+    if cache_path is not None and os.path.exists(cache_path):
+        return None, None, cache_path
+    codes, labels = encode_sample(encoder, data, sample_size, seed)
+    return codes, labels, cache_path
+
+
+def latent_embedding(encoder, data, sample_size=None, pca_components=50, perplexity=30.0, seed=0,
+                     cache_directory=None):
+    """Returns the 2d t-SNE embedding of the codes of a stratified sample of the dataset, or of all of it,
+    and their labels. With a cache_directory it is computed once per checkpoint and parameters."""
+    codes, labels, cache_path = sample_to_embed(encoder, data, sample_size, pca_components, perplexity, seed,
+                                                cache_directory)
+    return cached_embedding(codes, labels, cache_path, pca_components, perplexity, seed)
+
+
+def plot_latent_space(encoder, data, path, sample_size=None, pca_components=50, perplexity=30.0, seed=0,
+                      cache_directory=None):
+    """Saves a t-SNE plot of the latent space without blocking the caller, e.g. training. The sample is encoded
+    right away with the current weights, the embedding and the plot are made by the returned background thread.
+    The thread is not a daemon, so the interpreter waits for the plot at exit."""
+    def render(codes, labels, cache_path):
+        embedding, labels = cached_embedding(codes, labels, cache_path, pca_components, perplexity, seed)
+        visualize.tsne_plot(embedding, labels, path)
+
+    thread = Thread(target=render, args=sample_to_embed(encoder, data, sample_size, pca_components, perplexity,
+                                                        seed, cache_directory))
+    thread.start()
+    return thread
@@ -1,34 +1,53 @@
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import tensorflow as tf
-
-from tensorflow.keras import layers, losses
-
 import visualize
-from autoencoder import Autoencoder
 import config
-from neural_network import NeuralNetwork
-from preprocess import get_data, to_numpy, preprocess_data, remove_label, unlabel_data
+from latent import plot_latent_space
+from preprocess import get_data, preprocess_data, reconstruction_pairs
+from shards import ShardedSplit
+
+# The guard keeps importing this module from training, tensorflow is only loaded when it trains
+if __name__ == '__main__':
+    from tensorflow.keras import losses
+    from tensorflow.keras.callbacks import LambdaCallback
+
+    from autoencoder import Autoencoder
+    from neural_network import NeuralNetwork
+
+    (ds_train, ds_test), ds_info = get_data(config.name_of_dataset, config.train_test_split, config.shard_directory);
+
+    print(len(ds_train))
+
+    # The images are streamed to fit in shuffled batches instead of being copied into arrays first
+    train_data = reconstruction_pairs(preprocess_data(ds_train, shuffle=True, batch=True,
+                                                      batch_size=config.batch_size,
+                                                      shuffle_buffer_size=config.shuffle_buffer_size))
+    test_data = reconstruction_pairs(preprocess_data(ds_test, batch=True, batch_size=config.batch_size))
 
-(ds_train, ds_test), ds_info = get_data(config.name_of_dataset, config.train_test_split);
 
-print(len(ds_train))
+    autoencoder = Autoencoder(latent_dim=config.latent_vector_size, image_shape=(28, 28), num_labels=10)
+    nn = NeuralNetwork()
 
-x_train = to_numpy(unlabel_data(preprocess_data(ds_train)))
-x_test = to_numpy(unlabel_data(preprocess_data(ds_test)))
+    autoencoder.compile(optimizer=config.optimizer, loss=losses.MeanSquaredError())
 
+    callbacks = []
+    if config.tSNE_plots:
+        # The images of a ShardedSplit are read only for the sample
+        latent_data = ds_test if isinstance(ds_test, ShardedSplit) else preprocess_data(ds_test, batch=True,
+                                                                                        batch_size=1024)
 
-autoencoder = Autoencoder(latent_dim=config.latent_vector_size, image_shape=(28, 28), num_labels=10)
-nn = NeuralNetwork()
+        def plot_latent(epoch, logs):
+            if (epoch + 1) % config.tsne_every == 0:
+                plot_latent_space(autoencoder.encoder, latent_data, config.tsne_plot_path.format(epoch),
+                                  config.tsne_sample_size, config.tsne_pca_components, config.tsne_perplexity,
+                                  cache_directory=config.tsne_cache_directory)
 
-autoencoder.compile(optimizer=config.optimizer, loss=losses.MeanSquaredError())
+        callbacks.append(LambdaCallback(on_epoch_end=plot_latent))
 
-autoencoder.fit(x_train, x_train,
-                epochs=15,
-                shuffle=True,
-                validation_data=(x_test, x_test))
+    autoencoder.fit(train_data,
+                    epochs=15,
+                    validation_data=test_data,
+                    callbacks=callbacks)
 
-decoded_imgs = autoencoder.call(x_test).numpy()
+    x_test = next(iter(test_data.unbatch().batch(config.number_of_reconstructions)))[0].numpy()
+    decoded_imgs = autoencoder.call(x_test).numpy()
 
-visualize.show_reconstructions(config.number_of_reconstructions, actual=x_test, decoded_images=decoded_imgs)
+    visualize.show_reconstructions(config.number_of_reconstructions, actual=x_test, decoded_images=decoded_imgs)
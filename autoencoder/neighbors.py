@@ -0,0 +1,147 @@
+import numpy as np
+
+from latent import encode_dataset
+
+
+class LatentIndex:
+    """Nearest neighbor search over latent codes by euclidean distance. The exact search compares the queries with
+    all codes, block by block with one matrix multiply per block. The approximate search needs build_partitions:
+    the codes are partitioned by k-means, IVF style, and every query is only compared with the codes in the
+    num_probes partitions with the nearest centroids."""
+
+    def __init__(self, codes, labels=None):
+        self.codes = np.ascontiguousarray(codes, dtype=np.float32)
+        self.labels = labels
+        # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2, the norms of the codes are computed once
+        self.norms = np.einsum("ij,ij->i", self.codes, self.codes)
+        self.centroids = None
+        self.centroid_norms = None
+        # The codes sorted by partition, partition i is rows offsets[i]:offsets[i + 1] with the ids ids[...]
+        self.partition_codes = None
+        self.partition_norms = None
+        self.partition_ids = None
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def search(self, queries, k=10, num_probes=None, block_size=4096):
+        """Returns the distances and the indices of the k nearest codes of every query, nearest first.
+        With num_probes the search is approximate, see build_partitions, and can find fewer than k codes,
+        the missing ones have index -1 and distance inf."""
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        k = min(k, len(self))
+        if num_probes is None:
+            distances, index = self.search_blocks(queries, self.codes, self.norms, np.arange(len(self)), k,
+                                                  block_size)
+        elif self.centroids is None:
+            raise ValueError("The approximate search needs build_partitions first")
+        else:
+            distances, index = self.search_partitions(queries, k, num_probes)
+        order = np.argsort(distances, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        # Rounding can make the distance of a code to itself slightly negative
+        return np.sqrt(np.maximum(distances + query_norms[:, np.newaxis], 0)), np.take_along_axis(index, order, 1)
+
+    def search_blocks(self, queries, codes, norms, ids, k, block_size=4096):
+        # The k smallest ||x||^2 - 2 q.x of every query over the codes, without the ||q||^2 they all share
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_index = np.full((len(queries), k), -1)
+        for start in range(0, len(codes), block_size):
+            distances = queries @ codes[start:start + block_size].T
+            distances *= -2
+            distances += norms[start:start + block_size]
+            best_distances, best_index = merge_top_k(best_distances, best_index, distances,
+                                                     ids[start:start + block_size], k)
+        return best_distances, best_index
+
+    def search_partitions(self, queries, k, num_probes):
+        _, probes = self.search_blocks(queries, self.centroids, self.centroid_norms,
+                                       np.arange(len(self.centroids)), min(num_probes, len(self.centroids)))
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_index = np.full((len(queries), k), -1)
+        # Every partition is compared with all the queries that probe it in one matrix multiply
+        probe_queries = np.repeat(np.arange(len(queries)), probes.shape[1])
+        probe_partitions = probes.ravel()
+        order = np.argsort(probe_partitions, kind="stable")
+        probe_queries, probe_partitions = probe_queries[order], probe_partitions[order]
+        partitions, starts = np.unique(probe_partitions, return_index=True)
+        for partition, query_index in zip(partitions, np.split(probe_queries, starts[1:])):
+            start, end = self.offsets[partition], self.offsets[partition + 1]
+            if start == end:
+                continue
+            distances = queries[query_index] @ self.partition_codes[start:end].T
+            distances *= -2
+            distances += self.partition_norms[start:end]
+            best_distances[query_index], best_index[query_index] = merge_top_k(
+                best_distances[query_index], best_index[query_index], distances, self.partition_ids[start:end], k)
+        return best_distances, best_index
+
+    def build_partitions(self, num_partitions=None, iterations=10, sample_size=None, seed=0):
+        """Partitions the codes with k-means for the approximate search, by default into sqrt(len) partitions.
+        The centroids are trained on a sample of sample_size codes, by default 64 per partition."""
+        rng = np.random.default_rng(seed)
+        num_partitions = num_partitions or max(1, int(round(np.sqrt(len(self)))))
+        sample_size = min(len(self), sample_size or 64 * num_partitions)
+        sample = self.codes[np.sort(rng.choice(len(self), sample_size, replace=False))]
+        sample_norms = np.einsum("ij,ij->i", sample, sample)
+        centroids = sample[rng.choice(sample_size, num_partitions, replace=False)]
+        for _ in range(iterations):
+            assignments = self.assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=num_partitions)
+            nonempty = counts > 0
+            order = np.argsort(assignments, kind="stable")
+            # The sums of the codes of every nonempty partition, which are contiguous in partition order
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+            centroids[nonempty] = np.add.reduceat(sample[order], starts, axis=0) / counts[nonempty, np.newaxis]
+            # Empty partitions restart at the sampled codes farthest from their centroids
+            if not nonempty.all():
+                errors = sample_norms - 2 * np.einsum("ij,ij->i", sample, centroids[assignments]) + \
+                    np.einsum("ij,ij->i", centroids[assignments], centroids[assignments])
+                centroids[~nonempty] = sample[np.argsort(errors)[::-1][:np.count_nonzero(~nonempty)]]
+        self.centroids = np.ascontiguousarray(centroids)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        assignments = self.assign(self.codes, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        # A contiguous copy of the codes in partition order, so every partition is read as one block
+        self.partition_codes = self.codes[order]
+        self.partition_norms = self.norms[order]
+        self.partition_ids = order
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=num_partitions))])
+        return self
+
+    def assign(self, codes, centroids, block_size=4096):
+        # The index of the nearest centroid of every code
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        assignments = np.empty(len(codes), dtype=np.int64)
+        for start in range(0, len(codes), block_size):
+            distances = codes[start:start + block_size] @ centroids.T
+            distances *= -2
+            distances += centroid_norms
+            assignments[start:start + block_size] = np.argmin(distances, axis=1)
+        return assignments
+
+
+def merge_top_k(best_distances, best_index, distances, ids, k):
+    # Merges the k best of every row so far with a block of distances to the codes with the given ids
+    if distances.shape[1] > k:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        ids = ids[part]
+    else:
+        ids = np.broadcast_to(ids, distances.shape)
+    distances = np.concatenate([best_distances, distances], axis=1)
+    index = np.concatenate([best_index, ids], axis=1)
+    part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(distances, part, axis=1), np.take_along_axis(index, part, axis=1)
+
+
+def build_index(encoder, data, batch_size=1024, num_partitions=None):
+    """Encodes the dataset in batches and indexes the codes, with num_partitions also for the approximate search."""
+    codes, labels = encode_dataset(encoder, data, batch_size)
+    index = LatentIndex(codes, labels)
+    if num_partitions is not None:
+        index.build_partitions(num_partitions)
+    return index
@@ -1,11 +1,31 @@
-import matplotlib.pyplot as plt
+import os
+
 import numpy as np
-import pandas as pd
-import tensorflow as tf
-import tensorflow_datasets as tfds
 
+from shards import ShardStore, ShardedSplit, write_shards, synthetic_examples
+
+# tensorflow and tensorflow_datasets are imported by the functions that use them,
+# so that importing this module and reading a shard store do not load them
+
+
+def get_data(name_of_dataset, split, shard_directory=None):
+    """Returns the train and test split and the dataset info. With a shard_directory the dataset is written
+    to a shard store in it the first time and memory-mapped from the store after, see shards.py."""
+    if shard_directory is None:
+        if name_of_dataset == "synthetic":
+            raise ValueError("The synthetic dataset needs a shard_directory")
+        return load_tfds(name_of_dataset, split)
+    path = os.path.join(shard_directory, "{}-{}".format(name_of_dataset, int(split * 100)))
+    if not os.path.exists(path):
+        os.makedirs(shard_directory, exist_ok=True)
+        write_shards(path, get_examples(name_of_dataset, split))
+    store = ShardStore(path)
+    return (store.split("train"), store.split("test")), store.info
+
+
+def load_tfds(name_of_dataset, split):
+    import tensorflow_datasets as tfds
 
-def get_data(name_of_dataset, split):
     (ds_train, ds_test), ds_info = tfds.load(
         name_of_dataset,
         split=['train[0:{}%]'.format(int(split * 100)), 'test'],
@@ -16,8 +36,24 @@ def get_data(name_of_dataset, split):
     return (ds_train, ds_test), ds_info
 
 
+def get_examples(name_of_dataset, split, synthetic_size=10000):
+    """The (image, label) pairs of the train and test split as numpy arrays, to write to a shard store."""
+    if name_of_dataset == "synthetic":
+        train_size = int(split * synthetic_size)
+        return {
+            "train": synthetic_examples(train_size, seed=0),
+            "test": synthetic_examples(synthetic_size - train_size, seed=1),
+        }
+    import tensorflow_datasets as tfds
+
+    (ds_train, ds_test), _ = load_tfds(name_of_dataset, split)
+    return {"train": tfds.as_numpy(ds_train), "test": tfds.as_numpy(ds_test)}
+
+
 def normalize_img(image, label):
     """Normalizes images: `uint8` -> `float32`."""
+    import tensorflow as tf
+
     return tf.cast(image, tf.float32) / 255., label
 
 
@@ -25,21 +61,44 @@ def remove_label(image, label):
     return image
 
 
-def preprocess_data(data, shuffle=False, batch=False):
-    data = data.map(
-        normalize_img, num_parallel_calls=tf.data.experimental.AUTOTUNE).cache()
+def preprocess_data(data, shuffle=False, batch=False, batch_size=32, shuffle_buffer_size=None):
+    """Caches, optionally shuffles and batches, and normalizes the data, prefetching the next batches.
+    The uint8 images are cached and shuffled, a quarter of the memory of float32, and normalized per batch.
+    The shuffle buffer holds the whole dataset when its size is known, unless shuffle_buffer_size is given.
+    A ShardedSplit is shuffled as a whole and normalized per batch as it is read from the shards."""
+    import tensorflow as tf
+
+    if isinstance(data, ShardedSplit):
+        data = data.to_dataset(batch_size if batch else 1024, shuffle)
+        return data if batch else data.unbatch().prefetch(tf.data.experimental.AUTOTUNE)
+    data = data.cache()
     if shuffle:
-        data = data.shuffle(data.splits['train'].num_examples)
+        if shuffle_buffer_size is None:
+            shuffle_buffer_size = int(data.cardinality())
+            if shuffle_buffer_size < 0:
+                raise ValueError("The size of the dataset is unknown, pass shuffle_buffer_size")
+        data = data.shuffle(shuffle_buffer_size, reshuffle_each_iteration=True)
     if batch:
-        data = data.batch(32)
+        data = data.batch(batch_size)
+    data = data.map(normalize_img, num_parallel_calls=tf.data.experimental.AUTOTUNE)
     data = data.prefetch(tf.data.experimental.AUTOTUNE)
     return data
 
 
 def unlabel_data(data):
+    import tensorflow as tf
+
     return data.map(
         remove_label, num_parallel_calls=tf.data.experimental.AUTOTUNE)
 
 
+def reconstruction_pairs(data):
+    """Maps (image, label) elements or batches to (image, image), the input and target of the autoencoder."""
+    import tensorflow as tf
+
+    return data.map(
+        lambda image, label: (image, image), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+
 def to_numpy(x):
     return np.array(list(x.as_numpy_iterator()))
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# A shard store is a directory with
+#   index.json                    the image shape and the shards of every split
+#   <split>-<n>-images.npy        uint8 images, shard_size per shard
+#   <split>-<n>-labels.npy        int64 labels
+# The shards are memory-mapped, so opening a store reads nothing and the processes training
+# from the same store share its pages in the page cache.
+
+INDEX = "index.json"
+
+
+def write_shards(path, splits, shard_size=10000):
+    """Writes the (image, label) pairs of every split, given as a dict of iterables, to a shard store.
+    The store is written to a temporary directory and renamed to path, so a store at path is always complete."""
+    temporary_path = "{}.tmp-{}".format(path, os.getpid())
+    os.makedirs(temporary_path)
+    index = {"image_shape": None, "splits": {}}
+    for split, examples in splits.items():
+        index["splits"][split] = []
+        images, labels = None, np.empty(shard_size, dtype=np.int64)
+        size = 0
+        for image, label in examples:
+            if images is None:
+                index["image_shape"] = list(np.shape(image))
+                images = np.empty((shard_size,) + np.shape(image), dtype=np.uint8)
+            images[size], labels[size] = image, label
+            size += 1
+            if size == shard_size:
+                index["splits"][split].append(save_shard(temporary_path, split, images, labels, size,
+                                                         len(index["splits"][split])))
+                size = 0
+        if size:
+            index["splits"][split].append(save_shard(temporary_path, split, images, labels, size,
+                                                     len(index["splits"][split])))
+    with open(os.path.join(temporary_path, INDEX), "w") as file:
+        json.dump(index, file, indent=4)
+    try:
+        os.rename(temporary_path, path)
+    except OSError:
+        # Another process wrote the same store first
+        shutil.rmtree(temporary_path)
+
+
+def save_shard(path, split, images, labels, size, number):
+    shard = {
+        "images": "{}-{:05d}-images.npy".format(split, number),
+        "labels": "{}-{:05d}-labels.npy".format(split, number),
+        "size": size,
+    }
+    np.save(os.path.join(path, shard["images"]), images[:size])
+    np.save(os.path.join(path, shard["labels"]), labels[:size])
+    return shard
+
+
+def synthetic_examples(size, image_shape=(28, 28, 1), num_labels=10, seed=0):
+    """A stand-in for a real image dataset: noise with a bright horizontal band whose position is the label."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(num_labels, size=size)
+    images = rng.integers(0, 64, size=(size,) + tuple(image_shape), dtype=np.uint8)
+    band = max(1, image_shape[0] // num_labels)
+    rows = np.arange(image_shape[0])
+    top = labels[:, np.newaxis] * image_shape[0] // num_labels
+    images[(rows >= top) & (rows < top + band)] = 255
+    return zip(images, labels)
+
+
+class ShardStore:
+
+    def __init__(self, path):
+        with open(os.path.join(path, INDEX)) as file:
+            self.info = json.load(file)
+        self.path = path
+
+    def split(self, name):
+        if name not in self.info["splits"]:
+            raise ValueError("The shard store {} has no split {}".format(self.path, name))
+        shards = self.info["splits"][name]
+        images = [np.load(os.path.join(self.path, shard["images"]), mmap_mode="r") for shard in shards]
+        labels = [np.load(os.path.join(self.path, shard["labels"]), mmap_mode="r") for shard in shards]
+        return ShardedSplit(images, labels, tuple(self.info["image_shape"]))
+
+
+class ShardedSplit:
+    """The memory-mapped shards of one split, read in batches that are normalized to float32 as they are read."""
+
+    def __init__(self, images, labels, image_shape):
+        self.images = images
+        self.labels = labels
+        self.image_shape = image_shape
+        self.offsets = np.cumsum([0] + [len(shard) for shard in images])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def all_labels(self):
+        return np.concatenate(self.labels) if self.labels else np.empty(0, dtype=np.int64)
+
+    def take(self, index):
+        """Returns the normalized images and the labels at the given indices."""
+        index = np.asarray(index)
+        shard = np.searchsorted(self.offsets, index, side="right") - 1
+        images = np.empty((len(index),) + self.image_shape, dtype=np.float32)
+        labels = np.empty(len(index), dtype=np.int64)
+        for s in np.unique(shard):
+            rows = shard == s
+            local = index[rows] - self.offsets[s]
+            images[rows] = self.images[s][local]
+            labels[rows] = self.labels[s][local]
+        # The same float32 division as normalize_img
+        images /= 255
+        return images, labels
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        """Yields batches of normalized images and their labels, in a new order every call when shuffling."""
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            # The order within a batch does not matter, sorted indices read the shards front to back
+            yield self.take(np.sort(order[start:start + batch_size]))
+
+    def to_dataset(self, batch_size, shuffle=False, seed=None):
+        """A tf.data.Dataset of the batches, reshuffled every epoch when shuffling."""
+        # Only training from the store needs tensorflow
+        import tensorflow as tf
+
+        rng = np.random.default_rng(seed)
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, shuffle, rng),
+            output_types=(tf.float32, tf.int64),
+            output_shapes=((None,) + self.image_shape, (None,)))
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
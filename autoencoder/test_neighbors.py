@@ -0,0 +1,48 @@
+import numpy as np
+
+from neighbors import LatentIndex
+
+
+def random_codes(size, dimension=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((size, dimension)).astype(np.float32)
+
+
+def brute_force(queries, codes, k):
+    distances = np.sqrt(((queries[:, np.newaxis].astype(np.float64) - codes) ** 2).sum(axis=2))
+    index = np.argsort(distances, axis=1)[:, :k]
+    return np.take_along_axis(distances, index, axis=1), index
+
+
+def test_exact_search_matches_brute_force():
+    codes, queries = random_codes(1000), random_codes(20, seed=1)
+    distances, index = LatentIndex(codes).search(queries, k=7, block_size=128)
+    expected_distances, expected_index = brute_force(queries, codes, 7)
+    np.testing.assert_array_equal(index, expected_index)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-4, atol=1e-4)
+
+
+def test_k_is_clamped_to_the_number_of_codes():
+    codes, queries = random_codes(5), random_codes(3, seed=1)
+    distances, index = LatentIndex(codes).search(queries, k=10)
+    assert index.shape == distances.shape == (3, 5)
+    np.testing.assert_array_equal(index, brute_force(queries, codes, 5)[1])
+
+
+def test_probing_every_partition_is_exact():
+    codes, queries = random_codes(1000), random_codes(20, seed=1)
+    index = LatentIndex(codes).build_partitions(num_partitions=16)
+    exact_distances, exact_index = index.search(queries, k=7)
+    distances, found = index.search(queries, k=7, num_probes=16)
+    np.testing.assert_array_equal(found, exact_index)
+    np.testing.assert_allclose(distances, exact_distances, rtol=1e-5)
+
+
+def test_missing_neighbors_are_marked():
+    # Two clusters of three codes far apart, a query probing only the nearest partition finds three codes
+    codes = np.concatenate([np.zeros((3, 2)), np.full((3, 2), 100.0)]) + random_codes(6, 2) * 0.1
+    index = LatentIndex(codes).build_partitions(num_partitions=2)
+    np.testing.assert_array_equal(np.diff(index.offsets), [3, 3])
+    distances, found = index.search(np.zeros((1, 2)), k=5, num_probes=1)
+    np.testing.assert_array_equal(np.sort(found[0, :3]), [0, 1, 2])
+    np.testing.assert_array_equal(found[0, 3:], [-1, -1])
+    assert np.isfinite(distances[0, :3]).all() and np.isinf(distances[0, 3:]).all()
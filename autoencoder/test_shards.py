@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from shards import ShardStore, synthetic_examples, write_shards
+
+
+def source(size, seed=0):
+    images, labels = zip(*synthetic_examples(size, seed=seed))
+    return np.stack(images), np.array(labels)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "store")
+    write_shards(path, {"train": synthetic_examples(25), "test": synthetic_examples(7, seed=1)}, shard_size=10)
+    images, labels = source(25)
+    split = ShardStore(path).split("train")
+    assert len(split) == 25
+    assert [len(shard) for shard in split.images] == [10, 10, 5]
+    np.testing.assert_array_equal(split.all_labels(), labels)
+
+    # Rows from all three shards, out of order
+    index = np.array([24, 3, 9, 10, 19, 20, 0])
+    taken_images, taken_labels = split.take(index)
+    assert taken_images.dtype == np.float32
+    np.testing.assert_array_equal(taken_images, images[index].astype(np.float32) / 255)
+    np.testing.assert_array_equal(taken_labels, labels[index])
+
+    batches = list(split.batches(8))
+    np.testing.assert_array_equal(np.concatenate([batch_images for batch_images, _ in batches]),
+                                  images.astype(np.float32) / 255)
+    np.testing.assert_array_equal(np.concatenate([batch_labels for _, batch_labels in batches]), labels)
+
+    # Shuffled batches hold every image once, each with its own label
+    batches = list(split.batches(8, shuffle=True, seed=0))
+    shuffled_images = np.concatenate([batch_images for batch_images, _ in batches])
+    shuffled_labels = np.concatenate([batch_labels for _, batch_labels in batches])
+    rows = {image.tobytes(): i for i, image in enumerate(images.astype(np.float32) / 255)}
+    index = np.array([rows[image.tobytes()] for image in shuffled_images])
+    assert not np.array_equal(index, np.arange(25))
+    np.testing.assert_array_equal(np.sort(index), np.arange(25))
+    np.testing.assert_array_equal(shuffled_labels, labels[index])
+
+    test_images, _ = source(7, seed=1)
+    np.testing.assert_array_equal(ShardStore(path).split("test").take(np.arange(7))[0],
+                                  test_images.astype(np.float32) / 255)
+
+
+def test_existing_store_is_kept(tmp_path):
+    path = str(tmp_path / "store")
+    write_shards(path, {"train": synthetic_examples(12)}, shard_size=5)
+    # Another process writing the same store finds it there already, its temporary store is removed
+    write_shards(path, {"train": synthetic_examples(3, seed=1)}, shard_size=5)
+    assert os.listdir(str(tmp_path)) == ["store"]
+    images, labels = source(12)
+    split = ShardStore(path).split("train")
+    assert len(split) == 12
+    np.testing.assert_array_equal(split.take(np.arange(12))[0], images.astype(np.float32) / 255)
+    np.testing.assert_array_equal(split.all_labels(), labels)
@@ -1,8 +1,11 @@
-import matplotlib.pyplot as plt
-from sklearn.manifold import TSNE
+import os
+
+# matplotlib and sklearn are imported by the functions that use them, importing this module loads neither
 
 
 def show_reconstructions(num_reconstructions, actual, decoded_images):
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(20, 4))
     for i in range(num_reconstructions):
         # display original
@@ -23,12 +26,15 @@ def show_reconstructions(num_reconstructions, actual, decoded_images):
     plt.show()
 
 
-def tsne_plot(data):
-    plt.figure(figsize=(16, 10))
-    plt.scatterplot(
-        x="tsne-2d-one", y="tsne-2d-two",
-        hue="y",
-        data=data,
-        legend="full",
-        alpha=0.3
-    )
+def tsne_plot(embedding, labels, path):
+    """Saves a scatter plot of a 2d embedding colored by label. It draws on a Figure instead of pyplot,
+    so it can run in a background thread."""
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(16, 10))
+    axes = figure.subplots()
+    scatter = axes.scatter(embedding[:, 0], embedding[:, 1], c=labels, cmap="tab10", s=4, alpha=0.3)
+    axes.legend(*scatter.legend_elements(), title="label", loc="best")
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    figure.savefig(path)
@@ -2,28 +2,42 @@ import numpy as np
 
 
 class Activation:
+    # activation(x, out) computes the activation, writing into out when it is given.
+    # derivative(y, grad, out) returns grad scaled by the derivative, computed from the activation output y,
+    # so the forward value is never recomputed. out may be the same array as grad.
 
     def __init__(self, activation, derivative):
         self.activation = activation
         self.derivative = derivative
+        self.outputs = None
+        self.buffer = None
 
-    def forward(self, x):
-        self.inputs = x
-        return self.activation(x)
+    def forward(self, x, out=None):
+        self.outputs = self.activation(x, out)
+        return self.outputs
 
-    def backward(self, grad):
-        return self.derivative(self.inputs) * grad
+    def backward(self, grad, out=None):
+        return self.derivative(self.outputs, grad, out)
+
+    def __reduce__(self):
+        # The activation functions are closures, so an activation is pickled as a new instance of its class
+        return self.__class__, ()
+
+    def scratch(self, like):
+        if self.buffer is None or self.buffer.shape != like.shape or self.buffer.dtype != like.dtype:
+            self.buffer = np.empty_like(like)
+        return self.buffer
 
 
 class Relu(Activation):
 
     def __init__(self):
-        def relu(x):
-            return np.maximum(0, x)
-
-        def relu_derivative(x):
-            return (x > 0).astype(float)
+        def relu(x, out=None):
+            return np.maximum(x, 0, out=out)
 
+        def relu_derivative(y, grad, out=None):
+            mask = np.greater(y, 0, out=self.scratch(y))
+            return np.multiply(grad, mask, out=out)
 
         super().__init__(relu, relu_derivative)
 
@@ -31,12 +45,13 @@ class Relu(Activation):
 class Tanh(Activation):
 
     def __init__(self):
-        def tanh(x):
-            return np.tanh(x)
+        def tanh(x, out=None):
+            return np.tanh(x, out=out)
 
-        def tanh_derivative(x):
-            y = np.tanh(x)
-            return 1 - np.power(y, 2)
+        def tanh_derivative(y, grad, out=None):
+            derivative = np.multiply(y, y, out=self.scratch(y))
+            np.subtract(1, derivative, out=derivative)
+            return np.multiply(grad, derivative, out=out)
 
         super().__init__(tanh, tanh_derivative)
 
@@ -44,11 +59,16 @@ class Tanh(Activation):
 class Sigmoid(Activation):
 
     def __init__(self):
-        def sigmoid(x):
-            return 1 / (1 + np.exp(-x))
+        def sigmoid(x, out=None):
+            out = np.negative(x, out=out)
+            np.exp(out, out=out)
+            out += 1
+            return np.reciprocal(out, out=out)
 
-        def sigmoid_derivative(x):
-            return sigmoid(x) * (1 - sigmoid(x))
+        def sigmoid_derivative(y, grad, out=None):
+            derivative = np.subtract(1, y, out=self.scratch(y))
+            derivative *= y
+            return np.multiply(grad, derivative, out=out)
 
         super().__init__(sigmoid, sigmoid_derivative)
 
@@ -56,10 +76,13 @@ class Sigmoid(Activation):
 class Linear(Activation):
 
     def __init__(self):
-        def linear(x):
-            return x
-
-        def linear_derivative(x):
-            return 1
+        def linear(x, out=None):
+            if out is None or out is x:
+                return x
+            np.copyto(out, x)
+            return out
+
+        def linear_derivative(y, grad, out=None):
+            return linear(grad, out)
 
         super().__init__(linear, linear_derivative)
@@ -0,0 +1,53 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from matplotlib.figure import Figure
+
+
+class BackgroundValidator:
+    # Computes the validation loss of snapshots of the weights in a background thread, on a replica of the
+    # network, so the next epoch trains meanwhile. numpy releases the GIL in the matmuls, so the two overlap.
+    # The snapshots are validated one at a time in the order they were submitted.
+
+    def __init__(self, network, inputs, targets):
+        self.replica = network.replica()
+        self.inputs = inputs
+        self.targets = targets
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+
+    def submit(self, epoch, parameters):
+        self.pending.append((epoch, self.executor.submit(self.validate, parameters.copy())))
+
+    def validate(self, parameters):
+        self.replica.set_parameters(parameters)
+        return self.replica.calculate_validation_loss(self.inputs, self.targets)
+
+    def finished(self, wait=False):
+        # Yields the epoch and the validation loss of the snapshots that are done, in order,
+        # with wait=True of all of them
+        while self.pending and (wait or self.pending[0][1].done()):
+            epoch, future = self.pending.popleft()
+            yield epoch, future.result()
+
+    def close(self):
+        # Waits for the running validation, the ones not started yet are dropped, e.g. when fit failed
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def save_loss_plot(path, epochs, losses, validation_losses):
+    # Uses a Figure instead of pyplot, which keeps global state and is not safe to use outside the main thread
+    figure = Figure()
+    axes = figure.subplots()
+    axes.plot(epochs, losses, label="Training loss")
+    axes.plot(epochs, validation_losses, label="Validation loss")
+    axes.legend()
+    figure.savefig(path)
+
+
+def save_loss_plot_in_background(path, epochs, losses, validation_losses):
+    # The thread is not a daemon, so the interpreter waits for the plot at exit instead of training waiting for it
+    thread = Thread(target=save_loss_plot, args=(path, list(epochs), losses.copy(), validation_losses.copy()))
+    thread.start()
+    return thread
@@ -0,0 +1,394 @@
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from activations import Relu, Tanh, Sigmoid, Linear
+from config_parser import get_layers, get_loss_function, get_optimizer
+from data_generator import generate_dataset, batch_iterator
+from layers import Dense, RNN
+from loss import MSE
+from neural_network import NeuralNetwork
+from parallel import DataParallel
+from server import StreamingServer
+
+
+def measure(function, number=200, repeat=5, target_time=0.05):
+    # Returns the best time per call in microseconds and the peak bytes allocated by one call.
+    # number=None calls the function as often as fits in target_time seconds per repeat.
+    start = time.perf_counter()
+    function()
+    if number is None:
+        number = max(1, int(target_time / max(time.perf_counter() - start, 1e-9)))
+    time_per_call = min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return time_per_call, peak
+
+
+def legacy_activations():
+    # The activations as they were before the forward output was cached: the derivatives take the
+    # pre-activation and recompute the activation, and sigmoid computes it twice.
+    def sigmoid(x):
+        return 1 / (1 + np.exp(-x))
+
+    return {
+        "relu": (lambda x: np.maximum(0, x), lambda x: (x > 0).astype(float)),
+        "tanh": (np.tanh, lambda x: 1 - np.power(np.tanh(x), 2)),
+        "sigmoid": (sigmoid, lambda x: sigmoid(x) * (1 - sigmoid(x))),
+        "linear": (lambda x: x, lambda x: 1),
+    }
+
+
+def benchmark_activations(batch_size=32, hidden_size=256):
+    x = np.random.uniform(-1, 1, size=(batch_size, hidden_size))
+    grad = np.random.uniform(-1, 1, size=(batch_size, hidden_size))
+    out = np.empty_like(x)
+    # The layers activate their output buffer in place
+    buffer = x.copy()
+    activations = {"relu": Relu(), "tanh": Tanh(), "sigmoid": Sigmoid(), "linear": Linear()}
+    results = []
+    for name, (activation, derivative) in legacy_activations().items():
+        results.append((name, "before", "forward") + measure(lambda: activation(x)))
+        results.append((name, "before", "backward") + measure(lambda: derivative(x) * grad))
+
+        layer_activation = activations[name]
+        results.append((name, "after", "forward") + measure(lambda: layer_activation.forward(buffer, out=buffer)))
+        results.append((name, "after", "backward") + measure(lambda: layer_activation.backward(grad, out=out)))
+    return results
+
+
+def legacy_dense_backward(layer, inputs, outputs, grad):
+    # Dense.backward before it was batched: per sample diagonal matrices for the input and weight gradients
+    activation_grad = layer.activation.derivative(outputs, outputs)
+    neighbor_grad = np.mean([np.diag(activation_grad[i]) @ layer.weights.T for i in range(len(activation_grad))],
+                            axis=0)
+    weight_grad = np.sum([np.diag(grad[i]) @ np.outer(activation_grad[i], inputs[i]) for i in range(grad.shape[0])],
+                         axis=0)
+    return grad @ neighbor_grad, weight_grad.T
+
+
+def benchmark_dense(hidden_sizes=(64, 128, 256, 512, 1024, 2048), batch_size=32, sequence_length=8,
+                    legacy_max_size=256):
+    # The legacy backward materializes batch x hidden x hidden matrices, so it is only run up to legacy_max_size
+    results = []
+    for hidden_size in hidden_sizes:
+        name = "dense-{}".format(hidden_size)
+        layer = Dense(hidden_size, hidden_size, Sigmoid(), 0.001, (-0.1, 0.1))
+        x = np.random.uniform(-1, 1, size=(sequence_length, batch_size, hidden_size)).astype(layer.dtype)
+        grads = np.random.uniform(-1, 1, size=x.shape).astype(layer.dtype)
+        number = max(1, 20000 // hidden_size)
+
+        def step():
+            layer.reset_cache()
+            layer.forward(x[0])
+            layer.backward(grads[0])
+
+        def sequence():
+            layer.reset_cache()
+            layer.forward_sequence(x)
+            layer.backward_sequence(grads)
+
+        def legacy_step():
+            outputs = layer.activation.forward(x[0] @ layer.weights)
+            legacy_dense_backward(layer, x[0], outputs, grads[0])
+
+        if hidden_size <= legacy_max_size:
+            results.append((name, "before", "step") + measure(legacy_step, number, 3))
+        results.append((name, "after", "step") + measure(step, number, 3))
+        results.append((name, "after", "sequence") + measure(sequence, number, 3))
+    return results
+
+
+def benchmark_parallel(workers=(1, 2, 4, 8, 16), dataset_size=512, batch_size=64, epochs=3):
+    # Training throughput in samples per second on the three layer network of config_2.
+    # Scaling is bounded by the number of cores, the batch is split into one shard per worker.
+    from config_files.config_2 import layer_config, sequence_length, num_bits
+    inputs, targets = generate_dataset(dataset_size, sequence_length, num_bits)
+    results = []
+    for count in workers:
+        np.random.seed(0)
+        nn = NeuralNetwork(get_layers(layer_config), MSE(), 0.0001, get_optimizer("adam"))
+        parallel = DataParallel(nn, count) if count > 1 else None
+        epoch_times = []
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            for input_batch, target_batch in batch_iterator(batch_size, inputs, targets):
+                if parallel is None:
+                    nn.compute_grads(input_batch, target_batch)
+                else:
+                    parallel.compute_grads(input_batch, target_batch)
+                nn.update()
+                nn.reset_cache()
+            epoch_times.append(time.perf_counter() - start)
+        if parallel is not None:
+            parallel.close()
+        # The first epoch includes starting the workers
+        samples_per_second = dataset_size // batch_size * batch_size / min(epoch_times)
+        results.append(("workers-{}".format(count), samples_per_second))
+    return results
+
+
+def benchmark_inference(sequence_lengths=(100, 1000, 10000), batch_size=32):
+    # Time and peak memory of the predictions of one batch, with forward_sequence as in training and in inference
+    # mode. The memory is traced from the first call, so the buffers kept by the layers are included.
+    from config_files.config_2 import layer_config, num_bits
+    results = []
+    for sequence_length in sequence_lengths:
+        name = "T-{}".format(sequence_length)
+        x = np.random.randint(2, size=(batch_size, sequence_length, num_bits)).astype(np.float32)
+        number = max(1, 1000 // sequence_length)
+        for version, predict in (("training", lambda nn: nn.forward_sequence(np.swapaxes(x, 0, 1))[-1]),
+                                 ("inference", lambda nn: nn.predict_batch(x, batch_size))):
+            nn = NeuralNetwork(get_layers(layer_config), MSE(), 0.0001)
+            tracemalloc.start()
+            predict(nn)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            time_per_call = min(timeit.repeat(lambda: predict(nn), number=number, repeat=3)) / number * 1e6
+            results.append((name, version, "forward", time_per_call, peak))
+    return results
+
+
+def benchmark_server(streams=(1, 16, 256), steps=50, max_delay=0.002):
+    # Concurrent clients each stream steps timesteps of their own session to an in-process server over TCP
+    from config_files.config import layer_config, num_bits
+
+    async def run(count):
+        server = StreamingServer(NeuralNetwork(get_layers(layer_config), MSE(), 0.0001), max_delay=max_delay)
+        socket_server = await server.start("127.0.0.1", 0)
+        port = socket_server.sockets[0].getsockname()[1]
+
+        async def client(session):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for _ in range(steps):
+                request = {"session": session, "input": np.random.randint(2, size=num_bits).tolist()}
+                writer.write((json.dumps(request) + "\n").encode())
+                await reader.readline()
+            writer.close()
+            await writer.wait_closed()
+
+        await asyncio.gather(*[client(session) for session in range(count)])
+        stats = server.stats()
+        server.close()
+        socket_server.close()
+        await socket_server.wait_closed()
+        return stats
+
+    return [("streams-{}".format(count), asyncio.run(run(count))) for count in streams]
+
+
+def suite_cases(batch_sizes, hidden_sizes, sequence_lengths):
+    # Yields the name, the parameters and the setup of every case of the suite. setup() builds the inputs
+    # and returns the function to time, so only the case that runs is held in memory.
+    def parameters(batch_size=None, hidden_size=None, sequence_length=None):
+        values = {"batch_size": batch_size, "hidden_size": hidden_size, "sequence_length": sequence_length}
+        return {key: value for key, value in values.items() if value is not None}
+
+    for sequence_length in sequence_lengths:
+        yield ("generate_dataset", dict(parameters(sequence_length=sequence_length), size=10000),
+               lambda sequence_length=sequence_length: lambda: generate_dataset(10000, sequence_length, 10))
+
+    def iterate_epoch(batch_size, sequence_length):
+        inputs, targets = generate_dataset(10000, sequence_length, 10)
+
+        def epoch():
+            for _ in batch_iterator(batch_size, inputs, targets, shuffle=True, seed=0):
+                pass
+        return epoch
+
+    for batch_size in batch_sizes:
+        for sequence_length in sequence_lengths:
+            yield ("batch_iterator", dict(parameters(batch_size, sequence_length=sequence_length), size=10000),
+                   lambda b=batch_size, t=sequence_length: iterate_epoch(b, t))
+
+    def activation_pass(activation, direction, batch_size, hidden_size):
+        x = np.random.uniform(-1, 1, size=(batch_size, hidden_size)).astype(np.float32)
+        grad = np.random.uniform(-1, 1, size=x.shape).astype(np.float32)
+        out = np.empty_like(x)
+        activation.forward(x.copy(), out=out)
+        if direction == "forward":
+            return lambda: activation.forward(x, out=out)
+        return lambda: activation.backward(grad, out=grad)
+
+    for name, activation in (("relu", Relu), ("tanh", Tanh), ("sigmoid", Sigmoid), ("linear", Linear)):
+        for direction in ("forward", "backward"):
+            for batch_size in batch_sizes:
+                for hidden_size in hidden_sizes:
+                    yield ("activation.{}.{}".format(name, direction), parameters(batch_size, hidden_size),
+                           lambda a=activation, d=direction, b=batch_size, h=hidden_size: activation_pass(a(), d, b, h))
+
+    def loss_pass(method, batch_size, hidden_size, sequence_length):
+        loss = MSE()
+        predicted = np.random.rand(sequence_length, batch_size, hidden_size).astype(np.float32)
+        targets = np.random.randint(2, size=predicted.shape).astype(np.float32)
+        return lambda: getattr(loss, method)(predicted, targets)
+
+    def layer_pass(layer_class, direction, batch_size, hidden_size, sequence_length):
+        layer = layer_class(hidden_size, hidden_size, activation=Sigmoid(), learning_rate=0.001,
+                            weight_range=(-0.1, 0.1))
+        x = np.random.uniform(-1, 1, size=(sequence_length, batch_size, hidden_size)).astype(np.float32)
+        grads = np.random.uniform(-1, 1, size=x.shape).astype(np.float32)
+        layer.forward_sequence(x)
+        if direction == "forward_sequence":
+            return lambda: layer.forward_sequence(x)
+        return lambda: layer.backward_sequence(grads)
+
+    for batch_size in batch_sizes:
+        for hidden_size in hidden_sizes:
+            for sequence_length in sequence_lengths:
+                case = parameters(batch_size, hidden_size, sequence_length)
+                for method in ("loss", "grad"):
+                    yield ("mse.{}".format(method), case,
+                           lambda m=method, b=batch_size, h=hidden_size, t=sequence_length: loss_pass(m, b, h, t))
+                for name, layer_class in (("dense", Dense), ("rnn", RNN)):
+                    for direction in ("forward_sequence", "backward_sequence"):
+                        yield ("{}.{}".format(name, direction), case,
+                               lambda c=layer_class, d=direction, b=batch_size, h=hidden_size, t=sequence_length:
+                               layer_pass(c, d, b, h, t))
+
+    def fit_epoch(config):
+        inputs, targets = generate_dataset(config.dataset_size, config.sequence_length, config.num_bits)
+        nn = NeuralNetwork(get_layers(config.layer_config), get_loss_function(config.loss), config.learning_rate,
+                           get_optimizer(config.optimizer))
+        return lambda: nn.fit(inputs, targets, inputs[:30], targets[:30], 1, config.batch_size, False,
+                              backprop="bptt", shuffle=True, seed=0, log=False, plot_path=None)
+
+    for name in ("config", "config_2"):
+        yield "fit.{}".format(name), {}, lambda name=name: fit_epoch(
+            __import__("config_files." + name, fromlist=[name]))
+
+
+def benchmark_suite(batch_sizes=(32, 256), hidden_sizes=(64, 256), sequence_lengths=(8, 64), repeat=5):
+    results = []
+    for name, parameters, setup in suite_cases(batch_sizes, hidden_sizes, sequence_lengths):
+        np.random.seed(0)
+        time_per_call, peak = measure(setup(), None, repeat)
+        results.append({"name": name, "parameters": parameters, "time_us": time_per_call, "peak_bytes": peak})
+        print("{:<72} {:>14.2f} us".format(case_key(results[-1]), time_per_call))
+    return results
+
+
+def case_key(result):
+    parameters = ["{}={}".format(key, value) for key, value in sorted(result["parameters"].items())]
+    return " ".join([result["name"]] + parameters)
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_suite(path, results):
+    with open(path, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent=4)
+
+
+def compare_suites(baseline_path, path, threshold=0.25):
+    # Prints the time of every case relative to the baseline and returns the keys of the regressions,
+    # the cases that are more than threshold slower. Cases that are only in one of the files are skipped.
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    with open(path) as file:
+        current = json.load(file)
+    if baseline["environment"] != current["environment"]:
+        print("Warning: the results were measured in different environments")
+    baseline_times = {case_key(result): result["time_us"] for result in baseline["results"]}
+    regressions = []
+    print("{:<72} {:>14} {:>14} {:>8}".format("case", "baseline (us)", "current (us)", "ratio"))
+    for result in current["results"]:
+        key = case_key(result)
+        if key not in baseline_times:
+            continue
+        ratio = result["time_us"] / baseline_times[key]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "improved"
+        print("{:<72} {:>14.2f} {:>14.2f} {:>8.2f} {}".format(key, baseline_times[key], result["time_us"], ratio,
+                                                               flag))
+    print("{} regressions over {:.0f}%".format(len(regressions), threshold * 100))
+    return regressions
+
+
+def benchmark_gated(layer_types=("recurrent", "lstm", "gru"), hidden_size=64, target_accuracy=0.99, max_epochs=40,
+                    dataset_size=2000, batch_size=32, learning_rate=0.003):
+    # Training time until the sequence accuracy on a validation set reaches target_accuracy, or max_epochs
+    from config_files.config import sequence_length, num_bits
+    np.random.seed(0)
+    inputs, targets = generate_dataset(dataset_size, sequence_length, num_bits)
+    validation_inputs, validation_targets = generate_dataset(500, sequence_length, num_bits)
+    results = []
+    for layer_type in layer_types:
+        np.random.seed(0)
+        layer_config = [
+            {"type": "input", "size": num_bits},
+            {"type": layer_type, "size": hidden_size, "activation": "tanh", "learning_rate": learning_rate,
+             "weight_range": (-0.1, 0.1)},
+            {"type": "dense", "size": num_bits, "activation": "sigmoid", "learning_rate": learning_rate},
+        ]
+        nn = NeuralNetwork(get_layers(layer_config), MSE(), learning_rate, get_optimizer("adam"))
+        elapsed = 0.0
+        accuracy = 0.0
+        while nn.epoch < max_epochs and accuracy < target_accuracy:
+            start = time.perf_counter()
+            nn.fit(inputs, targets, validation_inputs[:1], validation_targets[:1], nn.epoch + 1, batch_size, False,
+                   backprop="bptt", shuffle=True, seed=nn.epoch, log=False, plot_path=None, initial_epoch=nn.epoch,
+                   background_validation=False)
+            elapsed += time.perf_counter() - start
+            accuracy = nn.evaluate(validation_inputs, validation_targets)["accuracy"]
+        results.append((layer_type, nn.epoch, elapsed, accuracy))
+    return results
+
+
+def print_results(title, results):
+    print(title)
+    print("{:<10} {:<8} {:<10} {:>12} {:>14}".format("name", "version", "pass", "time (us)", "allocated (B)"))
+    for name, version, direction, time_per_call, peak in results:
+        print("{:<10} {:<8} {:<10} {:>12.2f} {:>14}".format(name, version, direction, time_per_call, peak))
+
+
+if __name__ == '__main__':
+    # python benchmarks.py suite [results.json]                           runs the suite and saves its results
+    # python benchmarks.py compare baseline.json results.json [threshold]  exits with 1 on regressions
+    # python benchmarks.py                                               compares the optimizations with the originals
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        save_suite(sys.argv[2] if len(sys.argv) > 2 else "benchmark_results.json", benchmark_suite())
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else 0.25
+        sys.exit(1 if compare_suites(sys.argv[2], sys.argv[3], threshold) else 0)
+
+    print_results("Activations, batch 32 x hidden 256", benchmark_activations())
+    print_results("Activations, batch 256 x hidden 1024", benchmark_activations(256, 1024))
+    print_results("Dense forward and backward, batch 32, sequence mode over 8 timesteps", benchmark_dense())
+    print_results("Predictions of a batch of 32, config_2 network", benchmark_inference())
+    print("Streaming server, config.py network, 50 timesteps per stream")
+    print("{:<12} {:>12} {:>12} {:>12} {:>12}".format("streams", "steps/s", "batch size", "p50 (ms)", "p99 (ms)"))
+    for name, stats in benchmark_server():
+        print("{:<12} {:>12.1f} {:>12.1f} {:>12.2f} {:>12.2f}".format(
+            name, stats["steps_per_second"], stats["mean_batch_size"], stats["latency_p50_ms"],
+            stats["latency_p99_ms"]))
+    print("Time to 99% sequence accuracy, hidden size 64, adam")
+    print("{:<10} {:>8} {:>10} {:>10}".format("layer", "epochs", "time (s)", "accuracy"))
+    for layer_type, epochs, elapsed, accuracy in benchmark_gated():
+        print("{:<10} {:>8} {:>10.2f} {:>10.3f}".format(layer_type, epochs, elapsed, accuracy))
+    print("Data parallel training, config_2 network, batch 64")
+    print("{:<10} {:>14}".format("workers", "samples/s"))
+    for name, samples_per_second in benchmark_parallel():
+        print("{:<10} {:>14.1f}".format(name, samples_per_second))
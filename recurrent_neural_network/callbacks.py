@@ -0,0 +1,161 @@
+import csv
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Callback:
+    # Hooks called by NeuralNetwork.fit. The batch logs hold the batch "loss" and its "size" in samples,
+    # the epoch logs the training "loss". The validation logs hold the training "loss" and the "validation_loss"
+    # of an epoch, with background validation on_validation_end is called later, during a following epoch.
+
+    def on_train_begin(self, network):
+        pass
+
+    def on_epoch_begin(self, network, epoch):
+        pass
+
+    def on_batch_start(self, network, batch):
+        pass
+
+    def on_batch_end(self, network, batch, logs):
+        pass
+
+    def on_epoch_end(self, network, epoch, logs):
+        pass
+
+    def on_validation_end(self, network, epoch, logs):
+        pass
+
+    def on_train_end(self, network):
+        pass
+
+
+class BatchLogger(Callback):
+
+    def __init__(self, every=1):
+        self.every = every
+
+    def on_batch_end(self, network, batch, logs):
+        if batch % self.every == 0:
+            print("Batch {}, Loss {}".format(batch, logs["loss"]))
+
+
+class Profiler(Callback):
+    # Profiles fit: the time spent in the forward and backward pass of every layer, the loss gradient,
+    # the update, waiting for batch_iterator and the validation, the samples per second and the peak memory.
+    # With background validation only the time fit waits for it at the end is spent in "validation".
+    # The peak memory is traced with tracemalloc, which numpy reports its arrays to, and slows down fit,
+    # so it can be turned off. With data parallel training the layers run in the workers and are not timed.
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.layer_names = []
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.samples = 0
+        self.train_time = 0.0
+        self.peak_memory = 0
+        self.epochs = []
+        self.start = None
+        self.batch_end = None
+
+    @contextmanager
+    def time(self, section):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[section] += time.perf_counter() - start
+            self.calls[section] += 1
+
+    def on_train_begin(self, network):
+        self.layer_names = ["{}-{}".format(i, layer.name) for i, layer in enumerate(network.layers)]
+        network.profiler = self
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+
+    def on_epoch_begin(self, network, epoch):
+        self.batch_end = time.perf_counter()
+
+    def on_batch_start(self, network, batch):
+        # The time since the last batch ended was spent waiting for batch_iterator
+        self.times["data"] += time.perf_counter() - self.batch_end
+        self.calls["data"] += 1
+
+    def on_batch_end(self, network, batch, logs):
+        self.samples += logs["size"]
+        self.batch_end = time.perf_counter()
+
+    def on_epoch_end(self, network, epoch, logs):
+        epoch_stats = {"epoch": epoch, "loss": float(logs["loss"]), "validation_loss": None}
+        if self.trace_memory:
+            epoch_stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            self.peak_memory = max(self.peak_memory, epoch_stats["peak_memory"])
+            tracemalloc.reset_peak()
+        self.epochs.append(epoch_stats)
+
+    def on_validation_end(self, network, epoch, logs):
+        for epoch_stats in reversed(self.epochs):
+            if epoch_stats["epoch"] == epoch:
+                epoch_stats["validation_loss"] = float(logs["validation_loss"])
+                break
+
+    def on_train_end(self, network):
+        self.train_time += time.perf_counter() - self.start
+        network.profiler = None
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def section_name(self, section):
+        if isinstance(section, tuple):
+            return "{} {}".format(self.layer_names[section[0]], section[1])
+        return section
+
+    def report(self):
+        sections = []
+        for section in sorted(self.times, key=self.times.get, reverse=True):
+            sections.append({
+                "section": self.section_name(section),
+                "calls": self.calls[section],
+                "total_seconds": self.times[section],
+                "mean_ms": self.times[section] / self.calls[section] * 1000,
+                "share": self.times[section] / self.train_time if self.train_time else 0.0,
+            })
+        training_time = self.train_time - self.times.get("validation", 0.0)
+        return {
+            "train_seconds": self.train_time,
+            "samples": self.samples,
+            "samples_per_second": self.samples / training_time if training_time > 0 else 0.0,
+            "peak_memory": self.peak_memory if self.trace_memory else None,
+            "sections": sections,
+            "epochs": self.epochs,
+        }
+
+    def print_report(self):
+        report = self.report()
+        print("{:<24} {:>8} {:>12} {:>12} {:>8}".format("section", "calls", "total (s)", "mean (ms)", "share"))
+        for section in report["sections"]:
+            print("{:<24} {:>8} {:>12.4f} {:>12.4f} {:>7.1f}%".format(
+                section["section"], section["calls"], section["total_seconds"], section["mean_ms"],
+                section["share"] * 100))
+        print("Samples per second: {:.1f}".format(report["samples_per_second"]))
+        if report["peak_memory"] is not None:
+            print("Peak memory: {:.2f} MB".format(report["peak_memory"] / 2 ** 20))
+
+    def save(self, path):
+        # A .csv file gets the table of sections, any other file the whole report as JSON
+        report = self.report()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=list(report["sections"][0]))
+                writer.writeheader()
+                writer.writerows(report["sections"])
+        else:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=4, default=lambda value: np.asarray(value).tolist())
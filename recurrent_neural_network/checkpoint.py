@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from callbacks import Callback
+from config_parser import get_layers, get_loss_function, get_optimizer
+from neural_network import NeuralNetwork
+
+
+# A checkpoint is a directory with
+#   config.json    the network config, see network_config, and the number of epochs trained
+#   weights.npy    the flat parameter vector of the network
+#   optimizer.npz  the state of the optimizer
+# The whole checkpoint is written to <path>.tmp and swapped in with renames, the old one is moved to <path>.old
+# first, so the files of a checkpoint always belong to the same epoch. After a crash between the two renames
+# only <path>.old exists, it is loaded instead. Processes that have the old weights memory-mapped keep reading
+# them after the old checkpoint is removed.
+
+
+def network_config(layer_config, loss, learning_rate, optimizer, clip_norm=None, dtype="float32",
+                   cache_dtype=None):
+    return {
+        "layer_config": layer_config,
+        "loss": loss,
+        "learning_rate": learning_rate,
+        "optimizer": optimizer,
+        "clip_norm": clip_norm,
+        "dtype": dtype,
+        "cache_dtype": cache_dtype,
+    }
+
+
+def build_network(config):
+    layers = get_layers(config["layer_config"], dtype=config["dtype"], cache_dtype=config["cache_dtype"])
+    return NeuralNetwork(
+        layers=layers,
+        loss=get_loss_function(config["loss"], dtype=config["dtype"]),
+        learning_rate=config["learning_rate"],
+        optimizer=get_optimizer(config["optimizer"]),
+        clip_norm=config["clip_norm"],
+    )
+
+
+def save_checkpoint(path, network, config):
+    path = os.path.normpath(path)
+    temporary_path, previous_path = path + ".tmp", path + ".old"
+    # A left over temporary checkpoint is incomplete
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+    np.save(os.path.join(temporary_path, "weights.npy"), network.parameters)
+    np.savez(os.path.join(temporary_path, "optimizer.npz"), **network.optimizer.get_state())
+    with open(os.path.join(temporary_path, "config.json"), "w") as file:
+        json.dump(dict(config, epoch=network.epoch), file, indent=4)
+    if os.path.exists(path):
+        shutil.rmtree(previous_path, ignore_errors=True)
+        os.rename(path, previous_path)
+    os.rename(temporary_path, path)
+    shutil.rmtree(previous_path, ignore_errors=True)
+
+
+def checkpoint_directory(path):
+    # The directory the checkpoint at path is read from, <path>.old after a crash while it was swapped
+    path = os.path.normpath(path)
+    if not os.path.exists(path) and os.path.exists(path + ".old"):
+        return path + ".old"
+    return path
+
+
+def checkpoint_exists(path):
+    return os.path.exists(checkpoint_directory(path))
+
+
+def load_checkpoint(path, mmap_mode="r", resume=False):
+    # Returns the network and its config. By default the weights are memory-mapped read-only for inference,
+    # so the processes that load the same checkpoint share its pages and start without reading it.
+    # resume=True loads the weights into memory and restores the optimizer state and the epoch to train on.
+    path = checkpoint_directory(path)
+    with open(os.path.join(path, "config.json")) as file:
+        config = json.load(file)
+    network = build_network(config)
+    weights = np.load(os.path.join(path, "weights.npy"), mmap_mode=None if resume else mmap_mode)
+    if weights.shape != network.parameters.shape or weights.dtype != network.parameters.dtype:
+        raise ValueError("The weights in {} do not match the layer config".format(path))
+    network.bind_parameters(weights, copy=False)
+    if resume:
+        with np.load(os.path.join(path, "optimizer.npz")) as state:
+            network.optimizer.set_state({key: state[key] for key in state.files})
+        network.epoch = config["epoch"]
+    return network, config
+
+
+class Checkpoint(Callback):
+    # Saves a checkpoint every `every` epochs and after the last one
+
+    def __init__(self, path, config, every=1):
+        self.path = path
+        self.config = config
+        self.every = every
+        self.saved_epoch = None
+
+    def on_epoch_end(self, network, epoch, logs):
+        if network.epoch % self.every == 0:
+            self.save(network)
+
+    def on_train_end(self, network):
+        if self.saved_epoch != network.epoch:
+            self.save(network)
+
+    def save(self, network):
+        save_checkpoint(self.path, network, self.config)
+        self.saved_epoch = network.epoch
@@ -3,6 +3,8 @@
 dataset_size = 200
 sequence_length = 8
 num_bits = 10
+# Directory of a memory-mapped dataset, generated on the first run (None keeps the dataset in memory)
+dataset_path = None
 
 # Neural Network
 verbose = True
@@ -10,6 +12,35 @@ learning_rate = 0.0001
 epochs = 10
 batch_size = 32
 loss = 'mse'
+# Optimizer, 'sgd', 'rmsprop' or 'adam', or a dict with the name as 'type' and its hyperparameters
+optimizer = 'adam'
+# Scale the gradients down to this global norm before every update (None disables clipping)
+clip_norm = None
+# Directory a checkpoint is written to every checkpoint_every epochs (None disables checkpoints),
+# with resume the training continues from the checkpoint in it when there is one
+checkpoint_path = None
+checkpoint_every = 1
+resume = False
+# File the profile of the training is written to, .json or .csv (None disables profiling)
+profile_path = None
+# Number of processes each batch is split across for data parallel training
+workers = 1
+# Validate every epoch in a background thread while the next one trains
+background_validation = True
+# Batching, shuffle every epoch, pad the last partial batch instead of dropping it,
+# and the number of batches assembled ahead in a background thread
+shuffle = True
+seed = None
+pad_last = False
+prefetch = 2
+# Training dtype, and an optional reduced precision dtype ('float16') for the cached activations
+dtype = 'float32'
+cache_dtype = None
+# Backpropagation mode, either 'step', 'bptt' or 'tbptt'
+backprop = 'bptt'
+# Truncated BPTT, update every k1 timesteps from the errors backpropagated over the last k2 timesteps
+bptt_k1 = 4
+bptt_k2 = 8
 layer_config = [
     {
         'type': 'input',
@@ -0,0 +1,8 @@
+# Streaming inference server, run with python server.py
+host = '127.0.0.1'
+port = 8765
+# Checkpoint the weights are memory-mapped from, None serves an untrained network built from config.py
+checkpoint_path = None
+# A batch of timesteps is run when max_batch_size are waiting, or max_delay seconds after the first one arrived
+max_batch_size = 256
+max_delay = 0.002
@@ -0,0 +1,26 @@
+# Hyperparameter sweep over one of the config files, run with python sweep.py
+# The config file (1 or 2) whose dataset, training settings and layer_config every trial starts from
+config_file = 2
+# 'grid' runs every combination of the search space, 'random' samples num_trials combinations
+search = 'random'
+num_trials = 32
+seed = 0
+# Values tried for every parameter. learning_rate is set on every layer, size and activation
+# on every hidden layer, the input and output layers keep the sizes of the dataset
+search_space = {
+    'learning_rate': [0.00003, 0.0001, 0.0003, 0.001, 0.003],
+    'size': [16, 32, 64, 128],
+    'activation': ['sigmoid', 'tanh', 'relu'],
+    'optimizer': ['sgd', 'rmsprop', 'adam'],
+}
+
+# Successive halving: every trial trains for min_epochs, then only the best 1 / eta of them continue
+# with eta times as many epochs, until max_epochs is reached
+min_epochs = 2
+max_epochs = 18
+eta = 3
+
+# Number of trials trained at the same time
+workers = 4
+# Directory of the shared dataset and the results table
+output_path = 'sweeps/sweep'
@@ -1,10 +1,27 @@
 from activations import *
 from loss import *
 from layers import *
+from optimizers import *
 
-def get_loss_function(str):
+def get_loss_function(str, dtype="float32"):
     if str == "mse":
-        return MSE()
+        return MSE(dtype)
+    else:
+        raise NotImplementedError
+
+
+def get_optimizer(config):
+    # Either the name of the optimizer, or a dict with the name as "type" and its hyperparameters
+    if isinstance(config, str):
+        config = {"type": config}
+    type = config["type"]
+    if type == "sgd":
+        return SGD(momentum=get_value(config, "momentum", 0.0))
+    elif type == "rmsprop":
+        return RMSprop(rho=get_value(config, "rho", 0.9), epsilon=get_value(config, "epsilon", 1e-7))
+    elif type == "adam":
+        return Adam(beta1=get_value(config, "beta1", 0.9), beta2=get_value(config, "beta2", 0.999),
+                    epsilon=get_value(config, "epsilon", 1e-7))
     else:
         raise NotImplementedError
 
@@ -24,7 +41,7 @@ def get_activation_function(config):
         return Linear()
 
 
-def get_layers(config):
+def get_layers(config, dtype="float32", cache_dtype=None):
     default_learning_rate = 0.001
     default_weight_range = (-0.1, 0.1)
     config_layers = []
@@ -41,13 +58,23 @@ def get_layers(config):
             learning_rate = get_value(config[i], "learning_rate", default_learning_rate)
             weight_range = get_value(config[i], "weight_range", default_weight_range)
             config_layers.append(
-                RNN(input_size=input, output_size=output, activation=activation, learning_rate=learning_rate, weight_range=weight_range))
+                RNN(input_size=input, output_size=output, activation=activation, learning_rate=learning_rate,
+                    weight_range=weight_range, dtype=dtype, cache_dtype=cache_dtype))
+        elif type == "lstm" or type == "gru":
+            # The gated layers use sigmoid gates and tanh, they have no activation in the config
+            layer = LSTM if type == "lstm" else GRU
+            learning_rate = get_value(config[i], "learning_rate", default_learning_rate)
+            weight_range = get_value(config[i], "weight_range", default_weight_range)
+            config_layers.append(
+                layer(input_size=input, output_size=output, learning_rate=learning_rate, weight_range=weight_range,
+                      dtype=dtype, cache_dtype=cache_dtype))
         else:
             activation = get_activation_function(config[i])
             learning_rate = get_value(config[i], "learning_rate", default_learning_rate)
             weight_range = get_value(config[i], "weight_range", default_weight_range)
             config_layers.append(
-                Dense(input_size=input, output_size=output, activation=activation, learning_rate=learning_rate, weight_range=weight_range))
+                Dense(input_size=input, output_size=output, activation=activation, learning_rate=learning_rate,
+                      weight_range=weight_range, dtype=dtype, cache_dtype=cache_dtype))
     return config_layers
 
 def get_value(config, key, default):
@@ -1,28 +1,60 @@
+import os
+from queue import Queue, Full
+from threading import Event, Thread
+
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 
 
-def generate_dataset(size, sequence_length, num_bits):
-    patterns = [-2, -1, 1, 2]
-    inputs = []
-    targets = []
-    for _ in range(size):
-        pattern = np.random.choice(patterns)
-        sequence = np.zeros((sequence_length, num_bits))
-        target = np.zeros((sequence_length, num_bits))
-        bit_pattern = np.random.randint(2, size=num_bits)
-        for i in range(sequence_length):
-            sequence[i] = bit_pattern
-            bit_pattern = np.roll(bit_pattern, pattern)
-            target[i] = bit_pattern
-        inputs.append(sequence)
-        targets.append(target)
+def generate_dataset(size, sequence_length, num_bits, dtype="float32"):
+    # Every sequence is a random bit pattern rolled by one of the patterns at every timestep,
+    # the target is the same sequence one timestep ahead
+    patterns = np.array([-2, -1, 1, 2])
+    shifts = np.random.choice(patterns, size=size)
+    bit_patterns = np.random.randint(2, size=(size, num_bits))
+
+    # np.roll(bits, k)[j] == bits[(j - k) % num_bits], so timestep t of a sequence is the pattern rolled by t * shift
+    steps = np.arange(sequence_length + 1)
+    indices = (np.arange(num_bits) - steps[:, np.newaxis] * shifts[:, np.newaxis, np.newaxis]) % num_bits
+    sequences = bit_patterns[np.arange(size)[:, np.newaxis, np.newaxis], indices].astype(dtype)
+
+    inputs = np.ascontiguousarray(sequences[:, :-1])
+    targets = np.ascontiguousarray(sequences[:, 1:])
+    return inputs, targets
+
+
+def generate_chunks(size, sequence_length, num_bits, chunk_size=10000, dtype="float32"):
+    for start in range(0, size, chunk_size):
+        yield generate_dataset(min(chunk_size, size - start), sequence_length, num_bits, dtype)
+
+
+def write_dataset(path, size, sequence_length, num_bits, chunk_size=10000, dtype="float32"):
+    # Writes the dataset chunk by chunk into inputs.npy and targets.npy in the directory path,
+    # so datasets larger than memory can be generated
+    os.makedirs(path, exist_ok=True)
+    shape = (size, sequence_length, num_bits)
+    inputs = np.lib.format.open_memmap(os.path.join(path, "inputs.npy"), mode="w+", dtype=dtype, shape=shape)
+    targets = np.lib.format.open_memmap(os.path.join(path, "targets.npy"), mode="w+", dtype=dtype, shape=shape)
+    start = 0
+    for chunk_inputs, chunk_targets in generate_chunks(size, sequence_length, num_bits, chunk_size, dtype):
+        end = start + len(chunk_inputs)
+        inputs[start:end] = chunk_inputs
+        targets[start:end] = chunk_targets
+        start = end
+    inputs.flush()
+    targets.flush()
+    del inputs, targets
+
+
+def load_dataset(path, mmap_mode="r"):
+    inputs = np.load(os.path.join(path, "inputs.npy"), mmap_mode=mmap_mode)
+    targets = np.load(os.path.join(path, "targets.npy"), mmap_mode=mmap_mode)
     return inputs, targets
 
 
 def split_dataset(data, val_size, test_size):
-    df = np.array(data)
+    df = np.asarray(data)
     train, validate, test = np.split(df,
                                      [int(1 - (val_size + test_size) * len(df)), int(1 - test_size * len(df))])
     return train, validate, test
@@ -35,17 +67,83 @@ def visualize_data(data):
         plt.savefig("examples/sequence-{}.png".format(i))
 
 
-def batch_iterator(batch_size, inputs, targets):
+def batch_iterator(batch_size, inputs, targets, shuffle=False, seed=None, pad_last=False, prefetch=0):
+    # Yields time-major (time, batch, features) batches. Without shuffling the batches are views into the dataset.
+    # The last partial batch is dropped, unless pad_last is set, then it is padded with zeros and every batch
+    # is yielded together with a mask over the batch that is False for the padding.
+    # seed can be an int or a np.random.Generator, pass the same generator every epoch to get a new
+    # reproducible order per epoch. prefetch > 0 assembles that many batches ahead in a background thread.
+    inputs = np.ascontiguousarray(inputs)
+    targets = np.ascontiguousarray(targets)
+    batches = generate_batches(batch_size, inputs, targets, shuffle, seed, pad_last)
+    if prefetch > 0:
+        batches = prefetch_batches(batches, prefetch)
+    return batches
+
+
+def generate_batches(batch_size, inputs, targets, shuffle, seed, pad_last):
     size = len(inputs)
-    splits = np.arange(0, size, batch_size)
-    for start in splits:
-        end = start + batch_size
-        batch_inputs = np.array(inputs)[start:end].transpose((1, 0, 2))
-        batch_targets = np.array(targets)[start:end].transpose((1, 0, 2))
-        if batch_inputs.shape[1] == batch_size:
-            yield batch_inputs, batch_targets
+    order = np.random.default_rng(seed).permutation(size) if shuffle else None
+    for start in range(0, size, batch_size):
+        end = min(start + batch_size, size)
+        if end - start < batch_size and not pad_last:
+            break
+        if order is None:
+            batch_inputs = inputs[start:end]
+            batch_targets = targets[start:end]
         else:
+            # Sorted indices read the rows in storage order, which matters for memory-mapped datasets
+            indices = np.sort(order[start:end])
+            batch_inputs = inputs[indices]
+            batch_targets = targets[indices]
+        if not pad_last:
+            yield batch_inputs.transpose((1, 0, 2)), batch_targets.transpose((1, 0, 2))
             continue
+        mask = np.zeros(batch_size, dtype=bool)
+        mask[:end - start] = True
+        if end - start < batch_size:
+            padding = [(0, batch_size - (end - start)), (0, 0), (0, 0)]
+            batch_inputs = np.pad(batch_inputs, padding)
+            batch_targets = np.pad(batch_targets, padding)
+        yield batch_inputs.transpose((1, 0, 2)), batch_targets.transpose((1, 0, 2)), mask
+
+
+def prefetch_batches(batches, size):
+    queue = Queue(maxsize=size)
+    end = object()
+    # Set when the consumer stops, e.g. on an exception in fit or when the iterator is closed early,
+    # so the producer does not block on the full queue forever holding its batches and the dataset
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+        put(end)
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            batch = queue.get()
+            if batch is end:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
 
 
 if __name__ == '__main__':
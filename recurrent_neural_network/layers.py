@@ -1,6 +1,6 @@
 import numpy as np
 
-from activations import Linear
+from activations import Linear, Sigmoid, Tanh
 
 
 class Layer:
@@ -10,6 +10,10 @@ class Layer:
         self.learning_rate = learning_rate
         self.activation = activation
         self.name = name
+        # In inference mode forward keeps nothing for backpropagation, only the last output in a reused buffer
+        self.inference = False
+        # Size of the hidden state a session carries from one timestep to the next, see forward_sessions
+        self.state_size = 0
 
     def forward(self, x):
         raise NotImplementedError
@@ -17,9 +21,27 @@ class Layer:
     def backward(self, grad):
         raise NotImplementedError
 
-    def update(self):
+    def forward_sequence(self, x, initial_state=None):
         raise NotImplementedError
 
+    def backward_sequence(self, grads):
+        raise NotImplementedError
+
+    def get_state(self, t):
+        return None
+
+    def reset_state(self):
+        pass
+
+    def forward_sessions(self, x, states, started):
+        # One timestep of independent sessions, row i of x continues from row i of states, which holds
+        # the state_size hidden state of the session and is updated in place. started is False for the
+        # rows of sessions at their first timestep. Only used in inference mode.
+        return self.forward(x)
+
+    def parameters(self):
+        return {}
+
     def reset_inputs(self):
         raise NotImplementedError
 
@@ -39,8 +61,11 @@ class Input(Layer):
     def backward(self, grad):
         return grad
 
-    def update(self):
-        pass
+    def forward_sequence(self, x, initial_state=None):
+        return x
+
+    def backward_sequence(self, grads):
+        return grads
 
     def reset_cache(self):
         pass
@@ -48,129 +73,711 @@ class Input(Layer):
 
 class Dense(Layer):
 
-    def __init__(self, input_size, output_size, activation, learning_rate, weight_range):
+    def __init__(self, input_size, output_size, activation, learning_rate, weight_range, dtype="float32",
+                 cache_dtype=None):
         super().__init__(learning_rate, activation, "Dense")
-        self.weights = np.random.uniform(low=weight_range[0], high=weight_range[1], size=(input_size, output_size))
-        self.bias = np.random.rand(output_size)
-        self.inputs = None
+        self.dtype = np.dtype(dtype)
+        self.cache_dtype = self.dtype if cache_dtype is None else np.dtype(cache_dtype)
+        self.weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
+                                         size=(input_size, output_size)).astype(self.dtype)
+        self.bias = np.random.rand(output_size).astype(self.dtype)
+        self.inputs = []
         self.outputs = []
+        self.sequence_inputs = None
+        self.output_buffer = None
+        self.delta_buffer = None
+        self.input_grad_buffer = None
+        self.state_buffer = None
+        # The gradients are accumulated in place until the cache is reset
+        self.grads["weights"] = np.zeros_like(self.weights)
+        self.grads["bias"] = np.zeros_like(self.bias)
+        self.weight_grad_buffer = np.empty_like(self.weights)
 
     def forward(self, x):
-        self.inputs = x
-        output = self.activation.forward(x @ self.weights)  # + self.bias)
+        if self.inference:
+            self.state_buffer = allocate(self.state_buffer, x.shape[:-1] + (self.weights.shape[1],), self.dtype)
+            output = np.matmul(x, self.weights, out=self.state_buffer)
+            output += self.bias
+            return self.activation.forward(output, out=output)
+        output = x @ self.weights
+        output += self.bias
+        output = self.activation.forward(output, out=output)
+        self.inputs.append(x)
         self.outputs.append(output)
         return output
 
-    def backward(self, grad):
-        activation_grad = self.activation.backward(self.outputs.pop())
-
-        neighbor_grad = np.mean([np.diag(activation_grad[i]) @ self.weights.T for i in range(len(activation_grad))],
-                                axis=0)
-        weight_grad = update_weight_grad(self, grad, activation_grad)
-        bias_grad = activation_grad.sum()
-
-        self.grads["weights"] = weight_grad
-        self.grads["bias"] = bias_grad
+    def forward_sequence(self, x, initial_state=None):
+        # x has shape (time, batch, input_size), all timesteps are computed with a single matmul
+        shape = x.shape[:-1] + (self.weights.shape[1],)
+        self.output_buffer = allocate(self.output_buffer, shape, self.cache_dtype)
+        self.sequence_inputs = x
 
-        output = grad @ neighbor_grad
+        if self.cache_dtype == self.dtype:
+            np.matmul(x, self.weights, out=self.output_buffer)
+            self.output_buffer += self.bias
+            return self.activation.forward(self.output_buffer, out=self.output_buffer)
 
-        return output
+        # Reduced precision cache, every timestep is computed in the training dtype before it is stored
+        for t in range(len(x)):
+            output = x[t] @ self.weights
+            output += self.bias
+            self.output_buffer[t] = self.activation.forward(output, out=output)
+        return self.output_buffer
 
-    def update(self):
-        self.weights -= self.learning_rate * self.grads["weights"]
-        self.bias -= self.learning_rate * self.grads["bias"]
+    def backward(self, grad):
+        inputs = self.inputs.pop()
+        deltas = self.activation.derivative(self.outputs.pop(), grad)
+        self.accumulate_grads(inputs, deltas)
+        return deltas @ self.weights.T
+
+    def backward_sequence(self, grads):
+        # grads has shape (time, batch, output_size), every timestep is treated as part of one large batch
+        self.delta_buffer = allocate(self.delta_buffer, grads.shape, self.dtype)
+        deltas = self.activation.derivative(self.output_buffer, grads, out=self.delta_buffer)
+        self.accumulate_grads(self.sequence_inputs.reshape(-1, self.weights.shape[0]),
+                              deltas.reshape(-1, self.weights.shape[1]))
+
+        self.input_grad_buffer = allocate(self.input_grad_buffer, grads.shape[:-1] + (self.weights.shape[0],),
+                                          self.dtype)
+        return np.matmul(deltas, self.weights.T, out=self.input_grad_buffer)
+
+    def accumulate_grads(self, inputs, deltas):
+        np.matmul(inputs.T, deltas, out=self.weight_grad_buffer)
+        self.grads["weights"] += self.weight_grad_buffer
+        self.grads["bias"] += deltas.sum(axis=0)
+
+    def parameters(self):
+        return {"weights": self.weights, "bias": self.bias}
 
     def reset_cache(self):
-        self.inputs = None
+        self.inputs = []
         self.outputs = []
-        if "weights" in self.grads:
-            self.grads.pop("weights")
-            self.grads.pop("bias")
+        self.sequence_inputs = None
+        self.grads["weights"].fill(0)
+        self.grads["bias"].fill(0)
 
 
 class RNN(Layer):
 
-    def __init__(self, input_size, output_size, learning_rate, activation, weight_range):
+    def __init__(self, input_size, output_size, learning_rate, activation, weight_range, dtype="float32",
+                 cache_dtype=None):
         super().__init__(learning_rate, activation, "RNN")
-        self.inputs = None
-        self.outputs = []
-        self.weights = np.random.uniform(low=0.0, high=0.1, size=(input_size, output_size))
+        self.dtype = np.dtype(dtype)
+        self.cache_dtype = self.dtype if cache_dtype is None else np.dtype(cache_dtype)
+        self.weights = np.random.uniform(low=0.0, high=0.1, size=(input_size, output_size)).astype(self.dtype)
         self.internal_weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
-                                                  size=(output_size, output_size))
-        self.bias = np.random.rand(output_size)
+                                                  size=(output_size, output_size)).astype(self.dtype)
+        self.bias = np.random.rand(output_size).astype(self.dtype)
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.output_buffer = None
+        self.delta_buffer = None
+        self.input_grad_buffer = None
+        # Per timestep forward and backward, the cache of every timestep and the gradient carried back
+        self.step_cache = []
+        self.step_state = None
+        self.step_grad = None
+        # Inference mode, the last hidden state, which is one of two buffers the states are computed in in turn
+        self.state = None
+        self.state_buffers = None
+        self.projection_buffer = None
+        self.state_size = output_size
+        # The gradients are accumulated in place until the cache is reset
+        for key, parameter in self.parameters().items():
+            self.grads[key] = np.zeros_like(parameter)
 
     def forward(self, x):
-        if self.inputs is None:
-            first_iteration = True
-        else:
-            first_iteration = False
-        self.inputs = x
-        if first_iteration:
-            output = self.activation.forward(x @ self.weights + self.bias)
+        if self.inference:
+            return self.forward_inference(x)
+        output = x @ self.weights
+        if self.step_state is None:
+            output += self.bias
         else:
-            output = self.activation.forward(
-                self.outputs[-1] @ self.internal_weights + x @ self.weights)  # + self.bias)
-        self.outputs.append(output)
+            output += self.step_state @ self.internal_weights  # + self.bias
+        output = self.activation.forward(output, out=output)
+        self.step_cache.append((x, self.step_state, output))
+        self.step_state = output
         return output
 
+    def forward_inference(self, x):
+        # One timestep from the last hidden state, the new state is computed into the buffer that does not
+        # hold the last one, so only two hidden states of one timestep are kept however long the sequence is
+        shape = x.shape[:-1] + (self.internal_weights.shape[0],)
+        if self.state_buffers is None or self.state_buffers[0].shape != shape:
+            self.state_buffers = (np.empty(shape, dtype=self.dtype), np.empty(shape, dtype=self.dtype))
+            self.state = None
+        buffer = self.state_buffers[1] if self.state is self.state_buffers[0] else self.state_buffers[0]
+        output = np.matmul(x, self.weights, out=buffer)
+        if self.state is None:
+            output += self.bias
+        else:
+            self.projection_buffer = allocate(self.projection_buffer, shape, self.dtype)
+            output += np.matmul(self.state, self.internal_weights, out=self.projection_buffer)  # + self.bias
+        self.state = self.activation.forward(output, out=output)
+        return self.state
+
+    def forward_sessions(self, x, states, started):
+        output = x @ self.weights
+        output[~started] += self.bias
+        output[started] += states[started] @ self.internal_weights  # + self.bias
+        states[...] = self.activation.forward(output, out=output)
+        return states
+
+    def forward_sequence(self, x, initial_state=None):
+        # x has shape (time, batch, input_size). The input projection of every timestep is one matmul,
+        # the hidden states are written into buffers that are reused as long as the batch shape is unchanged.
+        # initial_state continues a sequence from a hidden state carried over from a previous chunk,
+        # it is treated as a constant in the backward pass.
+        shape = x.shape[:-1] + (self.internal_weights.shape[0],)
+        self.output_buffer = allocate(self.output_buffer, shape, self.cache_dtype)
+        self.sequence_inputs = x
+        self.initial_state = initial_state
+
+        outputs = self.output_buffer
+        if self.cache_dtype != self.dtype:
+            # Reduced precision cache, the recurrence runs on a hidden state in the training dtype
+            state = initial_state
+            for t in range(len(x)):
+                pre_activation = x[t] @ self.weights
+                if state is None:
+                    pre_activation += self.bias
+                else:
+                    pre_activation += state @ self.internal_weights  # + self.bias
+                state = self.activation.forward(pre_activation, out=pre_activation)
+                outputs[t] = state
+            return outputs
+
+        # The pre-activations are accumulated in the output buffer and activated in place
+        np.matmul(x, self.weights, out=outputs)
+        if initial_state is None:
+            outputs[0] += self.bias
+        else:
+            outputs[0] += initial_state @ self.internal_weights  # + self.bias
+        self.activation.forward(outputs[0], out=outputs[0])
+        for t in range(1, len(x)):
+            outputs[t] += outputs[t - 1] @ self.internal_weights  # + self.bias
+            self.activation.forward(outputs[t], out=outputs[t])
+        return outputs
+
+    def backward(self, grad):
+        # The timesteps are backpropagated in reverse order of forward, carrying the state gradient back
+        x, previous_output, output = self.step_cache.pop()
+        output_grad = grad if self.step_grad is None else grad + self.step_grad
+        deltas = self.activation.derivative(output, output_grad)
+        self.grads["weights"] += x.T @ deltas
+        if previous_output is None:
+            # The bias is only added at the first timestep of a sequence
+            self.grads["bias"] += deltas.sum(axis=0)
+        else:
+            self.grads["internal_weights"] += previous_output.T @ deltas
+        self.step_grad = deltas @ self.internal_weights.T
+        return deltas @ self.weights.T
+
+    def backward_sequence(self, grads):
+        # Backpropagation through time, grads has shape (time, batch, output_size).
+        # Only the delta recurrence is sequential, the weight gradients are one matmul over all timesteps.
+        inputs = self.sequence_inputs
+        outputs = self.output_buffer
+
+        self.delta_buffer = allocate(self.delta_buffer, outputs.shape, self.dtype)
+        deltas = self.delta_buffer
+        internal_weights_t = self.internal_weights.T
+        self.activation.derivative(outputs[-1], grads[-1], out=deltas[-1])
+        for t in reversed(range(len(grads) - 1)):
+            np.matmul(deltas[t + 1], internal_weights_t, out=deltas[t])
+            deltas[t] += grads[t]
+            self.activation.derivative(outputs[t], deltas[t], out=deltas[t])
+
+        hidden_size = deltas.shape[-1]
+        self.grads["weights"] += inputs.reshape(-1, inputs.shape[-1]).T @ deltas.reshape(-1, hidden_size)
+        self.grads["internal_weights"] += outputs[:-1].reshape(-1, hidden_size).T @ deltas[1:].reshape(-1, hidden_size)
+        # The bias is only added at the first timestep of a sequence
+        if self.initial_state is None:
+            self.grads["bias"] += deltas[0].sum(axis=0)
+        else:
+            self.grads["internal_weights"] += self.initial_state.T @ deltas[0]
+
+        self.input_grad_buffer = allocate(self.input_grad_buffer, inputs.shape, self.dtype)
+        return np.matmul(deltas, self.weights.T, out=self.input_grad_buffer)
+
+    def get_state(self, t):
+        return self.output_buffer[t].astype(self.dtype)
+
+    def reset_state(self):
+        self.state = None
+
+    def parameters(self):
+        return {"weights": self.weights, "internal_weights": self.internal_weights, "bias": self.bias}
+
+    def reset_cache(self):
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.step_cache = []
+        self.step_state = None
+        self.step_grad = None
+        for grad in self.grads.values():
+            grad.fill(0)
+
+
+class LSTM(Layer):
+    # Long short-term memory. The pre-activations of the input, forget and output gates and of the candidate
+    # cell state are computed together, in that order, with one matmul of the fused (input_size, 4 * hidden)
+    # input weights and one of the fused (hidden, 4 * hidden) internal weights per timestep, in the forward
+    # and the backward pass. The gates use sigmoid and the cell tanh, the activation of the config is not used.
+    # The state carried over between chunks and sessions is the hidden and the cell state concatenated.
+
+    def __init__(self, input_size, output_size, learning_rate, weight_range, dtype="float32", cache_dtype=None):
+        super().__init__(learning_rate, Tanh(), "LSTM")
+        self.dtype = np.dtype(dtype)
+        self.cache_dtype = self.dtype if cache_dtype is None else np.dtype(cache_dtype)
+        self.hidden_size = output_size
+        self.state_size = 2 * output_size
+        self.gate_activation = Sigmoid()
+        self.weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
+                                         size=(input_size, 4 * output_size)).astype(self.dtype)
+        self.internal_weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
+                                                  size=(output_size, 4 * output_size)).astype(self.dtype)
+        # A forget gate bias of one keeps the cell state from being forgotten at the start of training
+        self.bias = np.zeros(4 * output_size, dtype=self.dtype)
+        self.bias[output_size:2 * output_size] = 1
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.gate_buffer = None
+        self.cell_buffer = None
+        self.tanh_cell_buffer = None
+        self.output_buffer = None
+        self.delta_buffer = None
+        self.input_grad_buffer = None
+        self.projection_buffer = None
+        # Per timestep forward and backward, the cache of every timestep and the gradients carried back
+        self.step_cache = []
+        self.step_state = None
+        self.step_grads = None
+        # Inference mode
+        self.state = None
+        self.cell = None
+        self.output_state = None
+        # The gradients are accumulated in place until the cache is reset
+        for key, parameter in self.parameters().items():
+            self.grads[key] = np.zeros_like(parameter)
+
+    def split_state(self, state):
+        if state is None:
+            return None, None
+        return state[..., :self.hidden_size], state[..., self.hidden_size:]
+
+    def activate_gates(self, gates):
+        # Activates the pre-activations in place, returns the input, forget and output gates and the candidate
+        hidden_size = self.hidden_size
+        self.gate_activation.activation(gates[:, :3 * hidden_size], gates[:, :3 * hidden_size])
+        np.tanh(gates[:, 3 * hidden_size:], out=gates[:, 3 * hidden_size:])
+        return (gates[:, :hidden_size], gates[:, hidden_size:2 * hidden_size],
+                gates[:, 2 * hidden_size:3 * hidden_size], gates[:, 3 * hidden_size:])
+
+    def cell_forward(self, gates, cell, next_cell, tanh_cell, output):
+        input_gate, forget_gate, output_gate, candidate = self.activate_gates(gates)
+        np.multiply(input_gate, candidate, out=next_cell)
+        if cell is not None:
+            next_cell += forget_gate * cell
+        np.tanh(next_cell, out=tanh_cell)
+        np.multiply(output_gate, tanh_cell, out=output)
+
+    def cell_backward(self, output_grad, cell_grad, gates, cell, tanh_cell, deltas):
+        # output_grad and cell_grad are the gradients of the hidden and the cell state of this timestep,
+        # cell_grad is replaced by the gradient of the previous cell state. The gradients of the
+        # pre-activations are written into deltas.
+        hidden_size = self.hidden_size
+        input_gate, forget_gate, output_gate, candidate = (gates[:, :hidden_size],
+                                                           gates[:, hidden_size:2 * hidden_size],
+                                                           gates[:, 2 * hidden_size:3 * hidden_size],
+                                                           gates[:, 3 * hidden_size:])
+        np.multiply(output_grad, tanh_cell, out=deltas[:, 2 * hidden_size:3 * hidden_size])
+        cell_grad += output_grad * output_gate * (1 - tanh_cell * tanh_cell)
+        np.multiply(cell_grad, candidate, out=deltas[:, :hidden_size])
+        if cell is None:
+            deltas[:, hidden_size:2 * hidden_size] = 0
+        else:
+            np.multiply(cell_grad, cell, out=deltas[:, hidden_size:2 * hidden_size])
+        np.multiply(cell_grad, input_gate, out=deltas[:, 3 * hidden_size:])
+        cell_grad *= forget_gate
+
+        sigmoid_gates = gates[:, :3 * hidden_size]
+        deltas[:, :3 * hidden_size] *= sigmoid_gates * (1 - sigmoid_gates)
+        deltas[:, 3 * hidden_size:] *= 1 - candidate * candidate
+
+    def forward(self, x):
+        if self.inference:
+            return self.forward_inference(x)
+        output, cell = self.split_state(self.step_state)
+        gates = x @ self.weights
+        gates += self.bias
+        if output is not None:
+            gates += output @ self.internal_weights
+        shape = x.shape[:-1] + (self.hidden_size,)
+        next_cell, tanh_cell, next_output = np.empty(shape, self.dtype), np.empty(shape, self.dtype), \
+            np.empty(shape, self.dtype)
+        self.cell_forward(gates, cell, next_cell, tanh_cell, next_output)
+        self.step_cache.append((x, output, cell, gates, tanh_cell))
+        self.step_state = np.concatenate([next_output, next_cell], axis=-1)
+        return next_output
+
     def backward(self, grad):
+        # The timesteps are backpropagated in reverse order of forward, carrying the state gradients back
+        x, output, cell, gates, tanh_cell = self.step_cache.pop()
+        if self.step_grads is None:
+            output_grad, cell_grad = grad.astype(self.dtype), np.zeros(grad.shape, self.dtype)
+        else:
+            output_grad, cell_grad = grad + self.step_grads[0], self.step_grads[1]
+        deltas = np.empty_like(gates)
+        self.cell_backward(output_grad, cell_grad, gates, cell, tanh_cell, deltas)
+        self.grads["weights"] += x.T @ deltas
+        if output is not None:
+            self.grads["internal_weights"] += output.T @ deltas
+        self.grads["bias"] += deltas.sum(axis=0)
+        self.step_grads = (deltas @ self.internal_weights.T, cell_grad)
+        return deltas @ self.weights.T
+
+    def forward_inference(self, x):
+        # The cell state is updated in place and the hidden state is computed into the same buffer every timestep
+        shape = x.shape[:-1] + (self.hidden_size,)
+        if self.cell is None or self.cell.shape != shape:
+            self.cell = np.empty(shape, dtype=self.dtype)
+            self.output_state = np.empty(shape, dtype=self.dtype)
+            self.state = None
+        gates = np.matmul(x, self.weights, out=allocate(self.projection_buffer, shape[:-1] + (4 * self.hidden_size,),
+                                                        self.dtype))
+        self.projection_buffer = gates
+        gates += self.bias
+        if self.state is not None:
+            gates += self.state @ self.internal_weights
+        input_gate, forget_gate, output_gate, candidate = self.activate_gates(gates)
+        if self.state is None:
+            np.multiply(input_gate, candidate, out=self.cell)
+        else:
+            self.cell *= forget_gate
+            self.cell += input_gate * candidate
+        np.tanh(self.cell, out=self.output_state)
+        self.output_state *= output_gate
+        self.state = self.output_state
+        return self.state
+
+    def forward_sessions(self, x, states, started):
+        # The state of the sessions at their first timestep is zero, which is the same as no state
+        states[~started] = 0
+        output, cell = self.split_state(states)
+        gates = x @ self.weights
+        gates += self.bias
+        gates += output @ self.internal_weights
+        input_gate, forget_gate, output_gate, candidate = self.activate_gates(gates)
+        cell *= forget_gate
+        cell += input_gate * candidate
+        np.tanh(cell, out=output)
+        output *= output_gate
+        return output
 
-        if "delta_jacobian" in self.grads:
-            previous_output = self.outputs.pop()
-            activation_grad = self.activation.backward(previous_output)
-            recurrent = np.sum([np.diag(row) * self.internal_weights.T for row in activation_grad], axis=0)
-            delta_jacobian = grad + self.grads["delta_jacobian"] @ recurrent
+    def forward_sequence(self, x, initial_state=None):
+        # x has shape (time, batch, input_size). The input projection of every timestep is one matmul,
+        # the internal projection one fused matmul per timestep
+        hidden_size = self.hidden_size
+        shape = x.shape[:-1] + (hidden_size,)
+        self.gate_buffer = allocate(self.gate_buffer, x.shape[:-1] + (4 * hidden_size,), self.cache_dtype)
+        self.cell_buffer = allocate(self.cell_buffer, shape, self.cache_dtype)
+        self.tanh_cell_buffer = allocate(self.tanh_cell_buffer, shape, self.cache_dtype)
+        self.output_buffer = allocate(self.output_buffer, shape, self.cache_dtype)
+        self.sequence_inputs = x
+        self.initial_state = initial_state
+
+        # With a reduced precision cache every timestep is computed in the training dtype before it is stored
+        same_dtype = self.cache_dtype == self.dtype
+        if same_dtype:
+            np.matmul(x, self.weights, out=self.gate_buffer)
+            self.gate_buffer += self.bias
+        output, cell = self.split_state(initial_state)
+        for t in range(len(x)):
+            if same_dtype:
+                gates = self.gate_buffer[t]
+                next_cell, tanh_cell, next_output = self.cell_buffer[t], self.tanh_cell_buffer[t], \
+                    self.output_buffer[t]
+            else:
+                gates = x[t] @ self.weights
+                gates += self.bias
+                next_cell, tanh_cell, next_output = np.empty(shape[1:], self.dtype), \
+                    np.empty(shape[1:], self.dtype), np.empty(shape[1:], self.dtype)
+            if output is not None:
+                self.projection_buffer = allocate(self.projection_buffer, gates.shape, self.dtype)
+                gates += np.matmul(output, self.internal_weights, out=self.projection_buffer)
+            self.cell_forward(gates, cell, next_cell, tanh_cell, next_output)
+            if not same_dtype:
+                self.gate_buffer[t], self.cell_buffer[t], self.tanh_cell_buffer[t], self.output_buffer[t] = \
+                    gates, next_cell, tanh_cell, next_output
+            output, cell = next_output, next_cell
+        return self.output_buffer
+
+    def backward_sequence(self, grads):
+        # Backpropagation through time, only the gate gradients are computed per timestep,
+        # the weight gradients are one matmul over all timesteps
+        inputs = self.sequence_inputs
+        hidden_size = self.hidden_size
+        initial_output, initial_cell = self.split_state(self.initial_state)
+        self.delta_buffer = allocate(self.delta_buffer, self.gate_buffer.shape, self.dtype)
+        deltas = self.delta_buffer
+        output_grad = np.empty(grads.shape[1:], dtype=self.dtype)
+        cell_grad = np.zeros(grads.shape[1:], dtype=self.dtype)
+        recurrent_grad = None
+        for t in reversed(range(len(grads))):
+            if recurrent_grad is None:
+                output_grad[...] = grads[t]
+            else:
+                np.add(grads[t], recurrent_grad, out=output_grad)
+            cell = self.cell_buffer[t - 1] if t > 0 else initial_cell
+            self.cell_backward(output_grad, cell_grad, self.gate_buffer[t], cell, self.tanh_cell_buffer[t], deltas[t])
+            recurrent_grad = deltas[t] @ self.internal_weights.T
+
+        outputs = self.output_buffer
+        self.grads["weights"] += inputs.reshape(-1, inputs.shape[-1]).T @ deltas.reshape(-1, 4 * hidden_size)
+        self.grads["internal_weights"] += outputs[:-1].reshape(-1, hidden_size).T @ \
+            deltas[1:].reshape(-1, 4 * hidden_size)
+        if initial_output is not None:
+            self.grads["internal_weights"] += initial_output.T @ deltas[0]
+        self.grads["bias"] += deltas.sum(axis=(0, 1))
+
+        self.input_grad_buffer = allocate(self.input_grad_buffer, inputs.shape, self.dtype)
+        return np.matmul(deltas, self.weights.T, out=self.input_grad_buffer)
+
+    def get_state(self, t):
+        return np.concatenate([self.output_buffer[t], self.cell_buffer[t]], axis=-1).astype(self.dtype)
+
+    def reset_state(self):
+        self.state = None
+
+    def parameters(self):
+        return {"weights": self.weights, "internal_weights": self.internal_weights, "bias": self.bias}
+
+    def reset_cache(self):
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.step_cache = []
+        self.step_state = None
+        self.step_grads = None
+        for grad in self.grads.values():
+            grad.fill(0)
+
+
+class GRU(Layer):
+    # Gated recurrent unit. The reset and update gates and the candidate state are computed together, in that
+    # order, with one matmul of the fused (input_size, 3 * hidden) input weights and one of the fused
+    # (hidden, 3 * hidden) internal weights per timestep. The reset gate scales the internal projection of the
+    # candidate, r * (h @ U_n), so the internal projection of all three is one matmul.
+    # The gates use sigmoid and the candidate tanh, the activation of the config is not used.
+
+    def __init__(self, input_size, output_size, learning_rate, weight_range, dtype="float32", cache_dtype=None):
+        super().__init__(learning_rate, Tanh(), "GRU")
+        self.dtype = np.dtype(dtype)
+        self.cache_dtype = self.dtype if cache_dtype is None else np.dtype(cache_dtype)
+        self.hidden_size = output_size
+        self.state_size = output_size
+        self.gate_activation = Sigmoid()
+        self.weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
+                                         size=(input_size, 3 * output_size)).astype(self.dtype)
+        self.internal_weights = np.random.uniform(low=weight_range[0], high=weight_range[1],
+                                                  size=(output_size, 3 * output_size)).astype(self.dtype)
+        self.bias = np.zeros(3 * output_size, dtype=self.dtype)
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.gate_buffer = None
+        self.projection_buffer = None
+        self.output_buffer = None
+        self.delta_buffer = None
+        self.internal_delta_buffer = None
+        self.input_grad_buffer = None
+        # Per timestep forward and backward, the cache of every timestep and the gradient carried back
+        self.step_cache = []
+        self.step_state = None
+        self.step_grad = None
+        # Inference mode
+        self.state = None
+        self.state_buffer = None
+        # The gradients are accumulated in place until the cache is reset
+        for key, parameter in self.parameters().items():
+            self.grads[key] = np.zeros_like(parameter)
+
+    def cell_forward(self, gates, projection, output, next_output):
+        # gates holds the input projection of one timestep and projection the internal one,
+        # both are activated in place into the gates and the candidate
+        hidden_size = self.hidden_size
+        gates[:, :2 * hidden_size] += projection[:, :2 * hidden_size]
+        self.gate_activation.activation(gates[:, :2 * hidden_size], gates[:, :2 * hidden_size])
+        reset_gate, update_gate, candidate = (gates[:, :hidden_size], gates[:, hidden_size:2 * hidden_size],
+                                              gates[:, 2 * hidden_size:])
+        candidate += reset_gate * projection[:, 2 * hidden_size:]
+        np.tanh(candidate, out=candidate)
+        # h = (1 - z) * n + z * h_previous
+        if output is None:
+            np.subtract(1, update_gate, out=next_output)
+            next_output *= candidate
         else:
-            activation_grad = np.ones(grad.shape)
-            delta_jacobian = grad
-        act_k = self.activation.backward(self.outputs[-1])
-        if len(self.outputs) == 1:
-            next_output = np.zeros(grad.shape)
+            np.subtract(output, candidate, out=next_output)
+            next_output *= update_gate
+            next_output += candidate
+
+    def cell_backward(self, output_grad, gates, projection, output, deltas, internal_deltas):
+        # Writes the gradients of the input and of the internal pre-activations into deltas and internal_deltas,
+        # returns the part of the gradient of the previous hidden state that does not pass the internal weights
+        hidden_size = self.hidden_size
+        reset_gate, update_gate, candidate = (gates[:, :hidden_size], gates[:, hidden_size:2 * hidden_size],
+                                              gates[:, 2 * hidden_size:])
+        candidate_grad = deltas[:, 2 * hidden_size:]
+        np.multiply(output_grad, 1 - update_gate, out=candidate_grad)
+        candidate_grad *= 1 - candidate * candidate
+        np.multiply(candidate_grad, reset_gate, out=internal_deltas[:, 2 * hidden_size:])
+
+        np.multiply(candidate_grad, projection[:, 2 * hidden_size:], out=deltas[:, :hidden_size])
+        deltas[:, :hidden_size] *= reset_gate * (1 - reset_gate)
+        if output is None:
+            np.multiply(output_grad, -candidate, out=deltas[:, hidden_size:2 * hidden_size])
         else:
-            next_output = self.outputs[-2]
-        weight_grad = update_weight_grad(self, grad, act_k)
-        bias_grad = activation_grad.sum()
-        internal_weight_grad = update_internal_weight_grad(self, grad, act_k, next_output)
-        neighbor = np.sum([np.diag(row) @ self.weights.T for row in activation_grad], axis=0)
-        out_grad = delta_jacobian @ neighbor
-
-        self.grads["delta_jacobian"] = delta_jacobian
-        self.grads["weights"] = weight_grad
-        self.grads["internal_weights"] = internal_weight_grad
-        self.grads["bias"] = bias_grad
-        self.grads["out"] = out_grad
-
-        return out_grad
-
-    def update(self):
-        self.weights -= self.learning_rate * self.grads["weights"]
-        self.internal_weights -= self.learning_rate * self.grads["internal_weights"]
-        self.bias -= self.learning_rate * self.grads["bias"]
+            np.multiply(output_grad, output - candidate, out=deltas[:, hidden_size:2 * hidden_size])
+        deltas[:, hidden_size:2 * hidden_size] *= update_gate * (1 - update_gate)
+        internal_deltas[:, :2 * hidden_size] = deltas[:, :2 * hidden_size]
+        return output_grad * update_gate
+
+    def forward(self, x):
+        if self.inference:
+            return self.forward_inference(x)
+        output = self.step_state
+        gates = x @ self.weights
+        gates += self.bias
+        if output is None:
+            projection = np.zeros_like(gates)
+        else:
+            projection = output @ self.internal_weights
+        next_output = np.empty(x.shape[:-1] + (self.hidden_size,), dtype=self.dtype)
+        self.cell_forward(gates, projection, output, next_output)
+        self.step_cache.append((x, output, gates, projection))
+        self.step_state = next_output
+        return next_output
+
+    def backward(self, grad):
+        # The timesteps are backpropagated in reverse order of forward, carrying the state gradient back
+        x, output, gates, projection = self.step_cache.pop()
+        output_grad = grad if self.step_grad is None else grad + self.step_grad
+        deltas, internal_deltas = np.empty_like(gates), np.empty_like(gates)
+        previous_grad = self.cell_backward(output_grad, gates, projection, output, deltas, internal_deltas)
+        self.grads["weights"] += x.T @ deltas
+        if output is not None:
+            self.grads["internal_weights"] += output.T @ internal_deltas
+        self.grads["bias"] += deltas.sum(axis=0)
+        self.step_grad = previous_grad + internal_deltas @ self.internal_weights.T
+        return deltas @ self.weights.T
+
+    def forward_inference(self, x):
+        shape = x.shape[:-1] + (self.hidden_size,)
+        if self.state_buffer is None or self.state_buffer.shape != shape:
+            self.state_buffer = np.empty(shape, dtype=self.dtype)
+            self.state = None
+        gates = x @ self.weights
+        gates += self.bias
+        if self.state is None:
+            projection = np.zeros_like(gates)
+        else:
+            projection = self.state @ self.internal_weights
+        # The new state only depends on the old one elementwise, so it is computed in place
+        self.cell_forward(gates, projection, self.state, self.state_buffer)
+        self.state = self.state_buffer
+        return self.state
+
+    def forward_sessions(self, x, states, started):
+        states[~started] = 0
+        gates = x @ self.weights
+        gates += self.bias
+        self.cell_forward(gates, states @ self.internal_weights, states, states)
+        return states
+
+    def forward_sequence(self, x, initial_state=None):
+        hidden_size = self.hidden_size
+        gate_shape = x.shape[:-1] + (3 * hidden_size,)
+        self.gate_buffer = allocate(self.gate_buffer, gate_shape, self.cache_dtype)
+        self.projection_buffer = allocate(self.projection_buffer, gate_shape, self.cache_dtype)
+        self.output_buffer = allocate(self.output_buffer, x.shape[:-1] + (hidden_size,), self.cache_dtype)
+        self.sequence_inputs = x
+        self.initial_state = initial_state
+
+        # With a reduced precision cache every timestep is computed in the training dtype before it is stored
+        same_dtype = self.cache_dtype == self.dtype
+        if same_dtype:
+            np.matmul(x, self.weights, out=self.gate_buffer)
+            self.gate_buffer += self.bias
+        output = initial_state
+        for t in range(len(x)):
+            if same_dtype:
+                gates, projection, next_output = self.gate_buffer[t], self.projection_buffer[t], \
+                    self.output_buffer[t]
+            else:
+                gates = x[t] @ self.weights
+                gates += self.bias
+                projection, next_output = np.empty(gate_shape[1:], self.dtype), \
+                    np.empty(gate_shape[1:-1] + (hidden_size,), self.dtype)
+            if output is None:
+                projection.fill(0)
+            else:
+                np.matmul(output, self.internal_weights, out=projection)
+            self.cell_forward(gates, projection, output, next_output)
+            if not same_dtype:
+                self.gate_buffer[t], self.projection_buffer[t], self.output_buffer[t] = gates, projection, \
+                    next_output
+            output = next_output
+        return self.output_buffer
+
+    def backward_sequence(self, grads):
+        inputs = self.sequence_inputs
+        hidden_size = self.hidden_size
+        self.delta_buffer = allocate(self.delta_buffer, self.gate_buffer.shape, self.dtype)
+        self.internal_delta_buffer = allocate(self.internal_delta_buffer, self.gate_buffer.shape, self.dtype)
+        deltas, internal_deltas = self.delta_buffer, self.internal_delta_buffer
+        output_grad = np.empty(grads.shape[1:], dtype=self.dtype)
+        recurrent_grad = None
+        for t in reversed(range(len(grads))):
+            if recurrent_grad is None:
+                output_grad[...] = grads[t]
+            else:
+                np.add(grads[t], recurrent_grad, out=output_grad)
+            output = self.output_buffer[t - 1] if t > 0 else self.initial_state
+            recurrent_grad = self.cell_backward(output_grad, self.gate_buffer[t], self.projection_buffer[t], output,
+                                                deltas[t], internal_deltas[t])
+            recurrent_grad += internal_deltas[t] @ self.internal_weights.T
+
+        outputs = self.output_buffer
+        self.grads["weights"] += inputs.reshape(-1, inputs.shape[-1]).T @ deltas.reshape(-1, 3 * hidden_size)
+        self.grads["internal_weights"] += outputs[:-1].reshape(-1, hidden_size).T @ \
+            internal_deltas[1:].reshape(-1, 3 * hidden_size)
+        if self.initial_state is not None:
+            self.grads["internal_weights"] += self.initial_state.T @ internal_deltas[0]
+        self.grads["bias"] += deltas.sum(axis=(0, 1))
+
+        self.input_grad_buffer = allocate(self.input_grad_buffer, inputs.shape, self.dtype)
+        return np.matmul(deltas, self.weights.T, out=self.input_grad_buffer)
+
+    def get_state(self, t):
+        return self.output_buffer[t].astype(self.dtype)
+
+    def reset_state(self):
+        self.state = None
+
+    def parameters(self):
+        return {"weights": self.weights, "internal_weights": self.internal_weights, "bias": self.bias}
 
     def reset_cache(self):
-        self.inputs = None
-        self.outputs = []
-        if "delta_jacobian" in self.grads:
-            self.grads.pop("delta_jacobian")
-            self.grads.pop("internal_weights")
-            self.grads.pop("weights")
-            self.grads.pop("bias")
-            self.grads.pop("out")
-
-
-def update_weight_grad(self, grad, activation_grad):
-    new_grad = np.sum([np.diag(grad[i]) @ np.outer(activation_grad[i], self.inputs[i]) for i in range(grad.shape[0])],
-                      axis=0)
-    if "weights" in self.grads:
-        weight_grad = self.grads["weights"] + new_grad.T
-        return weight_grad
-    return new_grad.T
-
-
-def update_internal_weight_grad(self, grad, activation_grad, next_output):
-    new_grad = np.sum([np.diag(grad[i]) @ np.outer(activation_grad[i], next_output[i]) for i in range(grad.shape[0])],
-                      axis=0)
-    if "internal_weights" in self.grads:
-        weight_grad = self.grads["internal_weights"] + new_grad.T
-        return weight_grad
-    return new_grad.T
+        self.sequence_inputs = None
+        self.initial_state = None
+        self.step_cache = []
+        self.step_state = None
+        self.step_grad = None
+        for grad in self.grads.values():
+            grad.fill(0)
+
+
+def allocate(buffer, shape, dtype):
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        return np.empty(shape, dtype=dtype)
+    return buffer
+
@@ -2,6 +2,9 @@ import numpy as np
 
 
 class Loss:
+    def __init__(self, dtype="float32"):
+        self.dtype = np.dtype(dtype)
+
     def loss(self, predicted, actual):
         raise NotImplementedError
 
@@ -14,14 +17,16 @@ class MSE(Loss):
         return np.mean((predicted - actual) ** 2)
 
     def grad(self, predicted, actual):
-        return 2 * (predicted - actual)
+        grad = np.subtract(predicted, actual, dtype=self.dtype)
+        grad *= 2
+        return grad
 
 
 class CrossEntropy(Loss):
     def loss(self, predicted, actual):
-        return -actual * np.log2(predicted + 1e-20)
+        return -actual * np.log2(predicted + np.finfo(self.dtype).tiny)
 
     def grad(self, predicted, actual):
-        return np.where(predicted != 0, -actual / predicted, 0)
+        return np.where(predicted != 0, -actual / predicted, 0).astype(self.dtype, copy=False)
 
 
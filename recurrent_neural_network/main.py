@@ -1,6 +1,8 @@
-from data_generator import generate_dataset, split_dataset, batch_iterator
-from neural_network import NeuralNetwork
-from config_parser import *
+import os
+
+from callbacks import Profiler
+from checkpoint import network_config, build_network, load_checkpoint, checkpoint_exists, Checkpoint
+from data_generator import generate_dataset, split_dataset, batch_iterator, write_dataset, load_dataset
 
 config_file = 1
 if config_file == 1:
@@ -8,24 +10,53 @@ if config_file == 1:
 else:
     from config_files.config import *
 
-inputs, targets = generate_dataset(dataset_size, sequence_length, num_bits)
-train_inputs, val_inputs, test_inputs = split_dataset(inputs, 0.15, 0.15)
-train_targets, val_targets, test_targets = split_dataset(targets, 0.15, 0.15)
+# The guard keeps the data parallel workers from running the training when they import this module
+if __name__ == '__main__':
+    if dataset_path is None:
+        inputs, targets = generate_dataset(dataset_size, sequence_length, num_bits, dtype=dtype)
+    else:
+        if not os.path.exists(dataset_path):
+            write_dataset(dataset_path, dataset_size, sequence_length, num_bits, dtype=dtype)
+        inputs, targets = load_dataset(dataset_path)
+    train_inputs, val_inputs, test_inputs = split_dataset(inputs, 0.15, 0.15)
+    train_targets, val_targets, test_targets = split_dataset(targets, 0.15, 0.15)
 
-layers = get_layers(layer_config)
+    config = network_config(layer_config, loss, learning_rate, optimizer, clip_norm, dtype, cache_dtype)
+    if resume and checkpoint_path is not None and checkpoint_exists(checkpoint_path):
+        nn, config = load_checkpoint(checkpoint_path, resume=True)
+    else:
+        nn = build_network(config)
+    callbacks = []
+    if checkpoint_path is not None:
+        callbacks.append(Checkpoint(checkpoint_path, config, checkpoint_every))
+    if profile_path is not None:
+        profiler = Profiler()
+        callbacks.append(profiler)
 
-nn = NeuralNetwork(
-    layers=layers,
-    loss=get_loss_function(loss),
-    learning_rate=learning_rate,
-)
-nn.fit(
-    inputs=train_inputs,
-    targets=train_targets,
-    validation_inputs=val_inputs,
-    validation_targets=val_targets,
-    epochs=epochs,
-    batch_size=batch_size,
-    verbose=verbose
-)
-nn.eval2(test_inputs, test_targets)
+    nn.fit(
+        inputs=train_inputs,
+        targets=train_targets,
+        validation_inputs=val_inputs,
+        validation_targets=val_targets,
+        epochs=epochs,
+        batch_size=batch_size,
+        verbose=verbose,
+        backprop=backprop,
+        k1=bptt_k1,
+        k2=bptt_k2,
+        shuffle=shuffle,
+        seed=seed,
+        pad_last=pad_last,
+        prefetch=prefetch,
+        workers=workers,
+        background_validation=background_validation,
+        initial_epoch=nn.epoch,
+        callbacks=callbacks
+    )
+    if profile_path is not None:
+        profiler.print_report()
+        profiler.save(profile_path)
+    metrics = nn.evaluate(test_inputs, test_targets)
+    print("Test Loss {}".format(metrics["loss"]))
+    print("Accuracy: ", metrics["accuracy"] * 100, " %")
+    print("Bit Error Rate: ", metrics["bit_error_rate"] * 100, " %")
@@ -1,63 +1,275 @@
+import copy
+from contextlib import contextmanager, nullcontext
+
 import numpy as np
-import matplotlib.pyplot as plt
 
+from background import BackgroundValidator, save_loss_plot_in_background
 from data_generator import batch_iterator
 from layers import Layer
+from callbacks import BatchLogger
+from optimizers import SGD
+from parallel import DataParallel
 
 
 class NeuralNetwork:
 
-    def __init__(self, layers, loss, learning_rate):
+    def __init__(self, layers, loss, learning_rate, optimizer=None, clip_norm=None):
         self.layers = layers
         self.loss = loss
         self.learning_rate = learning_rate
+        self.clip_norm = clip_norm
+        self.parameters = None
+        self.grads = None
+        self.learning_rates = None
+        # Number of epochs trained, restored with the checkpoints
+        self.epoch = 0
+        # Set by a Profiler callback while it is profiling the training, see timed
+        self.profiler = None
+        self.allocate_parameters()
+        self.optimizer = (SGD() if optimizer is None else optimizer).bind(self.parameters, self.grads,
+                                                                          self.learning_rates)
+
+    def allocate_parameters(self, parameters=None, grads=None, copy=True):
+        # All parameters and gradients are stored in two contiguous vectors,
+        # the layers hold views into them in place of their own arrays.
+        # The vectors can be given, e.g. in shared memory, with copy=False their current values are kept.
+        layout = [(layer, key, parameter) for layer in self.layers for key, parameter in layer.parameters().items()]
+        size = sum(parameter.size for _, _, parameter in layout)
+        dtype = np.result_type(*[parameter.dtype for _, _, parameter in layout]) if layout else np.float32
+        self.parameters = np.empty(size, dtype=dtype) if parameters is None else parameters
+        self.grads = np.zeros(size, dtype=dtype) if grads is None else grads
+        self.learning_rates = np.empty(size, dtype=dtype)
+        offset = 0
+        for layer, key, parameter in layout:
+            end = offset + parameter.size
+            view = self.parameters[offset:end].reshape(parameter.shape)
+            if copy:
+                view[...] = parameter
+            setattr(layer, key, view)
+            layer.grads[key] = self.grads[offset:end].reshape(parameter.shape)
+            self.learning_rates[offset:end] = layer.learning_rate
+            offset = end
+
+    def bind_parameters(self, parameters=None, grads=None, copy=True):
+        # Moves the parameters into the given vectors, or into new private ones, keeping their values,
+        # or with copy=False taking the values of the given vectors
+        self.allocate_parameters(parameters, grads, copy)
+        self.optimizer.bind(self.parameters, self.grads, self.learning_rates)
+
+    def get_parameters(self):
+        return self.parameters.copy()
+
+    def set_parameters(self, parameters):
+        self.parameters[...] = parameters
+
+    def replica(self):
+        # A copy of the network that shares no arrays with it, e.g. to validate while this one trains.
+        # It has no optimizer, whose state is as large as the parameters, so it can not be trained.
+        profiler, optimizer = self.profiler, self.optimizer
+        self.profiler, self.optimizer = None, None
+        try:
+            replica = copy.deepcopy(self)
+        finally:
+            self.profiler, self.optimizer = profiler, optimizer
+        # The copied layers hold copies of the views, move them back into the copied vectors
+        replica.allocate_parameters()
+        return replica
+
+    def timed(self, section):
+        # Times the section with the profiler, section is a name or a (layer index, "forward"/"backward") pair
+        return nullcontext() if self.profiler is None else self.profiler.time(section)
 
     def forward(self, x):
-        for layer in self.layers:
-            x = layer.forward(x)
+        for i, layer in enumerate(self.layers):
+            with self.timed((i, "forward")):
+                x = layer.forward(x)
+        return x
+
+    def forward_sequence(self, x, initial_states=None):
+        if initial_states is None:
+            initial_states = [None] * len(self.layers)
+        for i, (layer, initial_state) in enumerate(zip(self.layers, initial_states)):
+            with self.timed((i, "forward")):
+                x = layer.forward_sequence(x, initial_state)
         return x
 
-    def backward(self, grads):
+    def backward(self, grads, update=True):
         for grad in reversed(grads):
-            for layer in reversed(self.layers):
-                grad = layer.backward(grad)
+            for i in reversed(range(len(self.layers))):
+                with self.timed((i, "backward")):
+                    grad = self.layers[i].backward(grad)
+        if update:
+            self.update()
+
+    def backward_sequence(self, grads, update=True):
+        for i in reversed(range(len(self.layers))):
+            with self.timed((i, "backward")):
+                grads = self.layers[i].backward_sequence(grads)
+        if update:
             self.update()
 
-    def fit(self, inputs, targets, validation_inputs, validation_targets, epochs, batch_size, verbose):
-        epoch_losses = np.zeros(epochs)
-        validation_loss = np.zeros(epochs)
-        for epoch in range(epochs):
-            batch_losses = []
-            for (input_batch, target_batch) in batch_iterator(batch_size, inputs, targets):
-                grads = []
-                for i in range(len(input_batch)):
-                    predicted = self.forward(input_batch[i])
-                    grads.append(self.loss.grad(predicted, target_batch[i]))
-                    if verbose:
-                        print("Pred: ", predicted)
-                        print("Target: ", target_batch[i])
-                        print("Grad: ", grads[-1])
-                batch_loss = self.loss.loss(predicted, target_batch[i])
-                batch_losses.append(batch_loss)
-                self.backward(grads)
-                self.reset_cache()
-            epoch_losses[epoch] = np.mean(np.array(batch_losses))
-            val_loss = self.calculate_validation_loss(validation_inputs, validation_targets)
-            validation_loss[epoch] = val_loss
-            print("Epoch {}, Loss {}".format(epoch, epoch_losses[epoch]))
-            print("Validation Loss {}".format(val_loss))
-
-        plt.plot([i for i in range(epochs)], epoch_losses, label="Training loss")
-        plt.plot([i for i in range(epochs)], validation_loss, label="Validation loss")
-        plt.legend()
-        plt.savefig("plots/training_validation_loss.png")
+    def compute_grads(self, inputs, targets, mask=None, backprop="bptt"):
+        # Forward and backward pass of one batch without updating the parameters, returns the batch loss
+        if backprop == "bptt":
+            predicted = self.forward_sequence(inputs)
+            grads = self.loss_grad(predicted, targets, mask)
+            self.backward_sequence(grads, update=False)
+            return self.batch_loss(predicted[-1], targets[-1], mask)
+
+        grads = []
+        for i in range(len(inputs)):
+            predicted = self.forward(inputs[i])
+            grads.append(self.loss_grad(predicted, targets[i], mask))
+        self.backward(grads, update=False)
+        return self.batch_loss(predicted, targets[-1], mask)
+
+    def batch_loss(self, predicted, targets, mask=None):
+        # The loss over the real rows of the batch, the padded rows are left out
+        if mask is None:
+            return self.loss.loss(predicted, targets)
+        return self.loss.loss(predicted[mask], targets[mask])
+
+    def loss_grad(self, predicted, targets, mask=None):
+        with self.timed("loss"):
+            grads = self.loss.grad(predicted, targets)
+            if mask is not None:
+                # Padded rows of the batch do not contribute to the gradient
+                grads *= mask[:, np.newaxis]
+        return grads
+
+    def backward_truncated(self, inputs, targets, k1, k2, mask=None):
+        # Truncated backpropagation through time. Every k1 timesteps the network is updated from the errors
+        # of those k1 timesteps, backpropagated over the last k2 timesteps. The hidden states are carried
+        # forward between windows without gradient, so only k2 timesteps are kept in memory.
+        check_window(k1, k2)
+        sequence_length = len(inputs)
+        states = None
+        end = 0
+        while end < sequence_length:
+            previous_end, end = end, min(end + k1, sequence_length)
+            start = max(0, end - k2)
+            predicted = self.forward_sequence(inputs[start:end], states)
+            grads = self.loss_grad(predicted, targets[start:end], mask)
+            grads[:previous_end - start] = 0
+            self.backward_sequence(grads)
+
+            next_start = max(0, min(end + k1, sequence_length) - k2)
+            if next_start > start:
+                states = [layer.get_state(next_start - start - 1) for layer in self.layers]
+            self.reset_cache()
+        return predicted
+
+    def fit(self, inputs, targets, validation_inputs, validation_targets, epochs, batch_size, verbose,
+            backprop="bptt", k1=None, k2=None, shuffle=False, seed=None, pad_last=False, prefetch=0, workers=1,
+            log=True, plot_path="plots/training_validation_loss.png", initial_epoch=0, callbacks=(),
+            background_validation=True):
+        # Trains from initial_epoch up to epochs, e.g. initial_epoch=nn.epoch to resume from a checkpoint.
+        # callbacks are Callback instances, verbose adds a BatchLogger that prints the loss of every batch.
+        # With background_validation every epoch is validated on a snapshot of the weights in a background
+        # thread while the next one trains, its loss is logged and passed to on_validation_end once it is done.
+        # Returns the training and validation loss of every epoch trained. The plot is saved by a background
+        # thread after fit returns, plot_path=None skips it.
+        if backprop not in ("step", "bptt", "tbptt"):
+            raise ValueError("Unknown backprop mode: {}".format(backprop))
+        if workers > 1 and backprop == "tbptt":
+            raise ValueError("Truncated BPTT updates within a batch and can not be run data parallel")
+        if backprop == "tbptt":
+            if k1 is None:
+                raise ValueError("Truncated BPTT needs the window length k1")
+            k2 = k1 if k2 is None else k2
+            check_window(k1, k2)
+        inputs = np.ascontiguousarray(inputs)
+        targets = np.ascontiguousarray(targets)
+        rng = np.random.default_rng(seed)
+        epoch_losses = np.zeros(max(0, epochs - initial_epoch))
+        validation_loss = np.zeros(len(epoch_losses))
+        callbacks = list(callbacks) + ([BatchLogger()] if verbose else [])
+        for callback in callbacks:
+            callback.on_train_begin(self)
+
+        def end_validation(epoch, val_loss):
+            i = epoch - initial_epoch
+            validation_loss[i] = val_loss
+            if log:
+                print("Epoch {}, Loss {}".format(epoch, epoch_losses[i]))
+                print("Validation Loss {}".format(val_loss))
+            logs = {"loss": epoch_losses[i], "validation_loss": val_loss}
+            for callback in callbacks:
+                callback.on_validation_end(self, epoch, logs)
+
+        # The worker pool is forked before the validation thread starts, forking while another thread runs
+        # can leave locks it holds locked in the workers
+        parallel = DataParallel(self, workers) if workers > 1 else None
+        validator = None
+        # Whatever fit stops on, the validation thread is stopped and the shared memory released, which also moves
+        # the parameters back into private memory
+        try:
+            validator = BackgroundValidator(self, validation_inputs, validation_targets) \
+                if background_validation and epochs > initial_epoch else None
+            for epoch in range(initial_epoch, epochs):
+                for callback in callbacks:
+                    callback.on_epoch_begin(self, epoch)
+                batch_losses = []
+                batches = batch_iterator(batch_size, inputs, targets, shuffle=shuffle, seed=rng, pad_last=pad_last,
+                                         prefetch=prefetch)
+                for index, batch in enumerate(batches):
+                    for callback in callbacks:
+                        callback.on_batch_start(self, index)
+                    input_batch, target_batch = batch[0], batch[1]
+                    mask = batch[2] if pad_last else None
+                    if backprop == "tbptt":
+                        predicted = self.backward_truncated(input_batch, target_batch, k1, k2, mask)
+                        batch_loss = self.batch_loss(predicted[-1], target_batch[-1], mask)
+                    elif parallel is not None:
+                        batch_loss = parallel.compute_grads(input_batch, target_batch, mask, backprop)
+                        self.update()
+                    else:
+                        batch_loss = self.compute_grads(input_batch, target_batch, mask, backprop)
+                        self.update()
+                    batch_losses.append(batch_loss)
+                    self.reset_cache()
+                    logs = {"loss": batch_loss, "size": input_batch.shape[1] if mask is None else int(mask.sum())}
+                    for callback in callbacks:
+                        callback.on_batch_end(self, index, logs)
+                i = epoch - initial_epoch
+                epoch_losses[i] = np.mean(np.array(batch_losses))
+                self.epoch = epoch + 1
+                for callback in callbacks:
+                    callback.on_epoch_end(self, epoch, {"loss": epoch_losses[i]})
+                if validator is None:
+                    with self.timed("validation"):
+                        end_validation(epoch, self.calculate_validation_loss(validation_inputs, validation_targets))
+                else:
+                    validator.submit(epoch, self.parameters)
+                    for finished in validator.finished():
+                        end_validation(*finished)
+            if validator is not None:
+                # Only the time fit waits for the last validations is spent in "validation"
+                with self.timed("validation"):
+                    for finished in validator.finished(wait=True):
+                        end_validation(*finished)
+        finally:
+            if validator is not None:
+                validator.close()
+            if parallel is not None:
+                parallel.close()
+        for callback in callbacks:
+            callback.on_train_end(self)
+
+        if plot_path is not None:
+            save_loss_plot_in_background(plot_path, range(initial_epoch, epochs), epoch_losses, validation_loss)
+        return epoch_losses, validation_loss
 
     def predict(self, input):
         return self.forward(input)[-1]
 
     def update(self):
-        for layer in self.layers:
-            layer.update()
+        with self.timed("update"):
+            if self.clip_norm is not None:
+                norm = np.linalg.norm(self.grads)
+                if norm > self.clip_norm:
+                    self.grads *= self.clip_norm / norm
+            self.optimizer.step()
 
     def print_weights(self):
         for layer in self.layers:
@@ -71,51 +283,63 @@ class NeuralNetwork:
         for layer in self.layers:
             layer.reset_grads()
 
-    def calculate_validation_loss(self, inputs, targets):
-        val_loss = np.zeros(len(inputs))
-        for i in range(len(inputs)):
-            prediction = self.forward(inputs[i])
-            val_loss[i] = self.loss.loss(prediction, targets[i])
-        self.reset_cache()
-        return np.mean(val_loss)
-
-    def calculate_val_loss(self, inputs, targets):
-        val_loss = np.zeros(len(inputs))
-        for (input_batch, target_batch) in batch_iterator(1, inputs, targets):
-            for i in range(len(input_batch)):
-                prediction = self.forward(input_batch[i])
-            val_loss[i] = self.loss.loss(prediction, targets[i][-1])
-        self.reset_cache()
-        return np.mean(val_loss)
-
-    def eval2(self, inputs, targets):
-        acc = 0
-        for (input_batch, target_batch) in batch_iterator(1, inputs, targets):
-            for i in range(len(input_batch)):
-                prediction = self.forward(input_batch[i])
-            cut_off_pred = []
-            for j in prediction[-1]:
-                if j > 0.45:
-                    cut_off_pred.append(1)
-                else:
-                    cut_off_pred.append(0)
-            if (cut_off_pred == targets[-1]).all():
-                acc += 1
-            print("Pred: {}\nTarget: {}\n".format(cut_off_pred, targets[i][-1]))
-        print("Accuracy: ", acc / len(inputs) * 100, " %")
-
-    def evaluate(self, inputs, targets):
-        acc = 0
-        np.set_printoptions(precision=4)
-        for i in range(len(inputs)):
-            prediction = self.predict(inputs[i])
-            cut_off_prediction = []
-            for j in prediction:
-                if j >= 0.5:
-                    cut_off_prediction.append(1)
-                else:
-                    cut_off_prediction.append(0)
-            if (np.array(cut_off_prediction) == targets[i][-1]).all():
-                acc += 1
-            print("Pred: {}\nTarg: {} \n".format(prediction, targets[i][-1]))
-        # print("Accuracy: ", acc / len(inputs) * 100, " %")
+    def reset_state(self):
+        for layer in self.layers:
+            layer.reset_state()
+
+    @contextmanager
+    def inference(self):
+        # No-grad mode for validation and serving: forward keeps only the last output of every layer in a
+        # reused buffer and nothing for backpropagation, the grads are never touched.
+        # The returned arrays are overwritten by the next forward, copy them to keep them.
+        # The profiler times inference as a whole, e.g. as the validation section, not per layer.
+        for layer in self.layers:
+            layer.inference = True
+        self.reset_state()
+        profiler, self.profiler = self.profiler, None
+        try:
+            yield self
+        finally:
+            self.profiler = profiler
+            self.reset_state()
+            for layer in self.layers:
+                layer.inference = False
+
+    def calculate_validation_loss(self, inputs, targets, batch_size=1024):
+        # Loss of the last timestep of every sequence, the same as the training loss and evaluate()["loss"],
+        # inputs has shape (samples, time, features)
+        return self.loss.loss(self.predict_batch(inputs, batch_size), targets[:, -1])
+
+    def predict_batch(self, inputs, batch_size=1024):
+        # Predictions of the last timestep of every sequence, inputs has shape (samples, time, features).
+        # Runs in inference mode, so the memory used does not grow with the sequence length.
+        predictions = None
+        with self.inference():
+            for start in range(0, len(inputs), batch_size):
+                self.reset_state()
+                for t in range(inputs.shape[1]):
+                    prediction = self.forward(inputs[start:start + batch_size, t])
+                if predictions is None:
+                    predictions = np.empty((len(inputs),) + prediction.shape[1:], dtype=prediction.dtype)
+                predictions[start:start + len(prediction)] = prediction
+        return predictions
+
+    def evaluate(self, inputs, targets, batch_size=1024, threshold=0.5):
+        # A sequence is correct when every bit of the last timestep is predicted,
+        # the bit error rate is the fraction of wrong bits over all sequences
+        predictions = self.predict_batch(inputs, batch_size)
+        targets = targets[:, -1]
+        errors = (predictions > threshold) != (targets > threshold)
+        return {
+            "loss": self.loss.loss(predictions, targets),
+            "accuracy": np.mean(~errors.any(axis=1)),
+            "bit_error_rate": np.mean(errors),
+        }
+
+
+def check_window(k1, k2):
+    # A window that does not advance would make backward_truncated loop forever
+    if isinstance(k1, bool) or not isinstance(k1, (int, np.integer)) or k1 < 1:
+        raise ValueError("k1 must be an integer of at least 1, got {!r}".format(k1))
+    if isinstance(k2, bool) or not isinstance(k2, (int, np.integer)) or k2 < k1:
+        raise ValueError("k2 must be an integer of at least k1, got k1={} and k2={!r}".format(k1, k2))
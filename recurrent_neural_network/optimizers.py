@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class Optimizer:
+    # Updates a flat parameter vector in place from the flat gradient vector of the same shape.
+    # learning_rates holds the learning rate of every parameter, since every layer has its own.
+
+    def __init__(self):
+        self.parameters = None
+        self.grads = None
+        self.learning_rate = None
+        self.buffer = None
+
+    def bind(self, parameters, grads, learning_rates):
+        self.parameters = parameters
+        self.grads = grads
+        if len(learning_rates) > 0 and np.all(learning_rates == learning_rates[0]):
+            self.learning_rate = learning_rates[0]
+        else:
+            self.learning_rate = learning_rates
+        # Rebinding to vectors of the same size, e.g. moved into shared memory, keeps the optimizer state
+        if self.buffer is None or self.buffer.shape != parameters.shape:
+            self.buffer = np.empty_like(parameters)
+            self.initialize()
+        return self
+
+    def initialize(self):
+        pass
+
+    def step(self):
+        self.update(self.parameters, self.grads, self.learning_rate, self.buffer)
+
+    def get_state(self):
+        # The arrays and counters needed to resume training, saved in the checkpoints
+        return {}
+
+    def set_state(self, state):
+        for key, value in state.items():
+            current = getattr(self, key)
+            if isinstance(current, np.ndarray):
+                current[...] = value
+            else:
+                setattr(self, key, type(current)(value))
+
+    def update(self, parameters, grads, learning_rate, buffer):
+        raise NotImplementedError
+
+
+class SGD(Optimizer):
+
+    def __init__(self, momentum=0.0):
+        super().__init__()
+        self.momentum = momentum
+        self.velocity = None
+
+    def initialize(self):
+        self.velocity = np.zeros_like(self.parameters)
+
+    def get_state(self):
+        return {"velocity": self.velocity}
+
+    def update(self, parameters, grads, learning_rate, buffer):
+        if self.momentum:
+            self.velocity *= self.momentum
+            self.velocity += grads
+            grads = self.velocity
+        np.multiply(grads, learning_rate, out=buffer)
+        parameters -= buffer
+
+
+class RMSprop(Optimizer):
+
+    def __init__(self, rho=0.9, epsilon=1e-7):
+        super().__init__()
+        self.rho = rho
+        self.epsilon = epsilon
+        self.mean_square = None
+
+    def initialize(self):
+        self.mean_square = np.zeros_like(self.parameters)
+
+    def get_state(self):
+        return {"mean_square": self.mean_square}
+
+    def update(self, parameters, grads, learning_rate, buffer):
+        np.square(grads, out=buffer)
+        buffer *= 1 - self.rho
+        self.mean_square *= self.rho
+        self.mean_square += buffer
+
+        np.sqrt(self.mean_square, out=buffer)
+        buffer += self.epsilon
+        np.divide(grads, buffer, out=buffer)
+        buffer *= learning_rate
+        parameters -= buffer
+
+
+class Adam(Optimizer):
+
+    def __init__(self, beta1=0.9, beta2=0.999, epsilon=1e-7):
+        super().__init__()
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.iterations = 0
+        self.first_moment = None
+        self.second_moment = None
+
+    def initialize(self):
+        self.first_moment = np.zeros_like(self.parameters)
+        self.second_moment = np.zeros_like(self.parameters)
+
+    def get_state(self):
+        return {"iterations": self.iterations, "first_moment": self.first_moment,
+                "second_moment": self.second_moment}
+
+    def step(self):
+        self.iterations += 1
+        super().step()
+
+    def update(self, parameters, grads, learning_rate, buffer):
+        np.multiply(grads, 1 - self.beta1, out=buffer)
+        self.first_moment *= self.beta1
+        self.first_moment += buffer
+
+        np.square(grads, out=buffer)
+        buffer *= 1 - self.beta2
+        self.second_moment *= self.beta2
+        self.second_moment += buffer
+
+        np.sqrt(self.second_moment, out=buffer)
+        buffer += self.epsilon
+        np.divide(self.first_moment, buffer, out=buffer)
+        # The bias correction of both moments is folded into the step size
+        buffer *= np.sqrt(1 - self.beta2 ** self.iterations) / (1 - self.beta1 ** self.iterations)
+        buffer *= learning_rate
+        parameters -= buffer
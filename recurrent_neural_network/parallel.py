@@ -0,0 +1,81 @@
+import tracemalloc
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# State of a worker process, set by initialize_worker
+replica = None
+shared_grads = None
+shared_memory = []
+
+
+class DataParallel:
+    # Data parallel training of a NeuralNetwork. The parameters are moved into shared memory, so every worker
+    # holds a replica that sees each update without copying. Every batch is split into one shard per worker,
+    # each worker writes the gradients of its shard into its row of a shared gradient matrix, and the rows
+    # are summed into the gradients of the network before the update.
+
+    def __init__(self, network, workers):
+        self.network = network
+        self.workers = workers
+        size = network.parameters.size
+        dtype = network.parameters.dtype
+
+        self.parameter_memory = SharedMemory(create=True, size=size * dtype.itemsize)
+        self.grad_memory = SharedMemory(create=True, size=workers * size * dtype.itemsize)
+        parameters = np.ndarray(size, dtype=dtype, buffer=self.parameter_memory.buf)
+        self.grads = np.ndarray((workers, size), dtype=dtype, buffer=self.grad_memory.buf)
+        network.bind_parameters(parameters, network.grads)
+
+        self.pool = Pool(workers, initializer=initialize_worker,
+                         initargs=(network, self.parameter_memory.name, self.grad_memory.name, workers))
+
+    def compute_grads(self, inputs, targets, mask=None, backprop="bptt"):
+        # inputs and targets are time-major, the shards are split along the batch axis
+        # A shard of only padding contributes no gradient and no loss, it is left out
+        indices = [shard for shard in np.array_split(np.arange(inputs.shape[1]), self.workers)
+                   if len(shard) > 0 and (mask is None or mask[shard].any())]
+        tasks = [(i, inputs[:, shard], targets[:, shard], None if mask is None else mask[shard], backprop)
+                 for i, shard in enumerate(indices)]
+        losses = self.pool.starmap(compute_shard_grads, tasks)
+        np.sum(self.grads[:len(tasks)], axis=0, out=self.network.grads)
+        # The shard losses are means over their real rows, the batch loss is their mean weighted by those
+        sizes = [len(shard) if mask is None else np.count_nonzero(mask[shard]) for shard in indices]
+        return np.average(losses, weights=sizes)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        # Move the parameters back into private memory before the shared memory is released
+        self.network.bind_parameters()
+        self.grads = None
+        self.parameter_memory.close()
+        self.parameter_memory.unlink()
+        self.grad_memory.close()
+        self.grad_memory.unlink()
+
+
+def initialize_worker(network, parameter_memory_name, grad_memory_name, workers):
+    global replica, shared_grads
+    # A worker forked while the Profiler traces memory inherits the tracing, which only slows it down,
+    # the memory of the workers is not reported
+    tracemalloc.stop()
+    parameter_memory = SharedMemory(name=parameter_memory_name)
+    grad_memory = SharedMemory(name=grad_memory_name)
+    shared_memory.extend([parameter_memory, grad_memory])
+
+    size = network.parameters.size
+    dtype = network.parameters.dtype
+    parameters = np.ndarray(size, dtype=dtype, buffer=parameter_memory.buf)
+    shared_grads = np.ndarray((workers, size), dtype=dtype, buffer=grad_memory.buf)
+    # The shared parameters may already have been updated, so the replica must not copy its own values into them
+    network.allocate_parameters(parameters, copy=False)
+    replica = network
+
+
+def compute_shard_grads(shard, inputs, targets, mask, backprop):
+    loss = replica.compute_grads(inputs, targets, mask, backprop)
+    shared_grads[shard] = replica.grads
+    replica.reset_cache()
+    return loss
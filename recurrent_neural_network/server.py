@@ -0,0 +1,221 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from config_files import server_config
+
+
+class SessionStates:
+    # The hidden states of every open session, one row per session in one array per layer,
+    # the rows of closed sessions are reused and the arrays double in size when they are full
+
+    def __init__(self, network, capacity=64):
+        self.dtype = network.parameters.dtype
+        self.slots = {}
+        self.free = list(reversed(range(capacity)))
+        self.states = [np.zeros((capacity, layer.state_size), dtype=self.dtype) for layer in network.layers]
+        self.started = np.zeros(capacity, dtype=bool)
+
+    def slot(self, session):
+        if session not in self.slots:
+            if not self.free:
+                self.grow()
+            slot = self.free.pop()
+            self.started[slot] = False
+            self.slots[session] = slot
+        return self.slots[session]
+
+    def release(self, session):
+        slot = self.slots.pop(session, None)
+        if slot is not None:
+            self.free.append(slot)
+
+    def grow(self):
+        capacity = len(self.started)
+        self.states = [np.concatenate([states, np.zeros_like(states)]) for states in self.states]
+        self.started = np.concatenate([self.started, np.zeros(capacity, dtype=bool)])
+        self.free.extend(reversed(range(capacity, 2 * capacity)))
+
+
+class StreamingServer:
+    # Serves next step predictions for many concurrent streams. Every request is one timestep of one session,
+    # the pending timesteps of all sessions are micro-batched: a batch is run as soon as max_batch_size
+    # timesteps are waiting or max_delay seconds after its first one arrived, with one matmul per layer.
+    # Requests are lines of JSON over a TCP socket:
+    #   {"session": "a", "input": [0, 1, ...]} -> {"session": "a", "prediction": [...]}
+    #   {"session": "a", "reset": true}        -> {"session": "a", "reset": true}, closes the session
+    #   {"stats": true}                        -> latency and throughput since the server started
+
+    def __init__(self, network, max_batch_size=256, max_delay=0.002, latency_window=10000):
+        self.network = network
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.states = SessionStates(network)
+        self.input_size = network.layers[0].input_size
+        self.queue = None
+        self.latencies = deque(maxlen=latency_window)
+        self.steps = 0
+        self.batches = 0
+        self.start_time = None
+        self.batch_task = None
+        for layer in network.layers:
+            layer.inference = True
+
+    async def predict(self, session, x):
+        # Invalid inputs are rejected here, so they can not fail a batch shared with other sessions
+        try:
+            x = np.asarray(x, dtype=self.states.dtype)
+        except TypeError:
+            raise ValueError("Expected an input of numbers, got {}".format(json.dumps(x)))
+        if x.shape != (self.input_size,):
+            raise ValueError("Expected an input of size {}, got shape {}".format(self.input_size, x.shape))
+        if not np.isfinite(x).all():
+            raise ValueError("Expected an input of finite numbers")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((session, x, future, time.perf_counter()))
+        return await future
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        while True:
+            if not pending:
+                pending.append(await self.queue.get())
+            deadline = loop.time() + self.max_delay
+            while len(pending) < self.max_batch_size:
+                if not self.queue.empty():
+                    pending.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # A session can only be in a batch once, its later timesteps wait for the next batch
+            batch, sessions = [], set()
+            for _ in range(len(pending)):
+                request = pending.popleft()
+                if request[0] in sessions or len(batch) == self.max_batch_size:
+                    pending.append(request)
+                else:
+                    sessions.add(request[0])
+                    batch.append(request)
+            try:
+                self.run_batch(batch)
+            except Exception as error:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def run_batch(self, batch):
+        slots = np.array([self.states.slot(session) for session, _, _, _ in batch])
+        started = self.states.started[slots]
+        x = np.stack([x for _, x, _, _ in batch])
+        for layer, states in zip(self.network.layers, self.states.states):
+            state = states[slots]
+            x = layer.forward_sessions(x, state, started)
+            states[slots] = state
+        self.states.started[slots] = True
+
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = batch[0][3]
+        for (_, _, future, start), prediction in zip(batch, x.tolist()):
+            if not future.done():
+                future.set_result(prediction)
+            self.latencies.append(now - start)
+        self.steps += len(batch)
+        self.batches += 1
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0
+        return {
+            "sessions": len(self.states.slots),
+            "steps": self.steps,
+            "batches": self.batches,
+            "mean_batch_size": self.steps / self.batches if self.batches else 0,
+            "steps_per_second": self.steps / elapsed if elapsed > 0 else 0,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0,
+        }
+
+    async def handle_client(self, reader, writer):
+        # A malformed request is answered with an error, the connection stays open
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = parse_request(line)
+                    response = await self.respond(request)
+                except ValueError as error:
+                    response = {"error": str(error)} if request is None else \
+                        {"session": request["session"], "error": str(error)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, request):
+        if "stats" in request:
+            return self.stats()
+        if request.get("reset"):
+            self.states.release(request["session"])
+            return {"session": request["session"], "reset": True}
+        if "input" not in request:
+            raise ValueError("The request has no input")
+        prediction = await self.predict(request["session"], request["input"])
+        return {"session": request["session"], "prediction": prediction}
+
+    async def start(self, host, port):
+        # Returns the asyncio server, the batches are run by a task for as long as the event loop runs
+        self.queue = asyncio.Queue()
+        self.batch_task = asyncio.create_task(self.run_batches())
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    def close(self):
+        if self.batch_task is not None:
+            self.batch_task.cancel()
+
+
+def parse_request(line):
+    # Raises a ValueError unless the line is a JSON object with a stats request or a valid session
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("Expected a JSON object, got {}".format(type(request).__name__))
+    if "stats" in request:
+        return request
+    if "session" not in request:
+        raise ValueError("The request has no session")
+    if not isinstance(request["session"], (str, int)) or isinstance(request["session"], bool):
+        raise ValueError("The session must be a string or an integer")
+    return request
+
+
+async def serve(network, host, port, max_batch_size, max_delay):
+    server = StreamingServer(network, max_batch_size, max_delay)
+    socket_server = await server.start(host, port)
+    print("Serving on {}:{}".format(host, port))
+    async with socket_server:
+        await socket_server.serve_forever()
+
+
+if __name__ == '__main__':
+    from checkpoint import network_config, build_network, load_checkpoint
+
+    if server_config.checkpoint_path is not None:
+        nn, _ = load_checkpoint(server_config.checkpoint_path)
+    else:
+        from config_files.config import layer_config, loss, learning_rate, optimizer, dtype
+        nn = build_network(network_config(layer_config, loss, learning_rate, optimizer, dtype=dtype))
+    asyncio.run(serve(nn, server_config.host, server_config.port, server_config.max_batch_size,
+                      server_config.max_delay))
@@ -0,0 +1,150 @@
+import csv
+import itertools
+import os
+from importlib import import_module
+from multiprocessing import Pool
+
+import numpy as np
+
+from config_files import sweep_config
+from config_parser import get_layers, get_loss_function, get_optimizer
+from data_generator import write_dataset, load_dataset, split_dataset
+from neural_network import NeuralNetwork
+
+# State of a worker process, set by initialize_worker
+config = None
+dataset = None
+
+
+def expand_search_space(search_space, search, num_trials, seed=None):
+    names = list(search_space)
+    if search == "grid":
+        return [dict(zip(names, values)) for values in itertools.product(*search_space.values())]
+    elif search == "random":
+        rng = np.random.default_rng(seed)
+        return [{name: search_space[name][rng.integers(len(search_space[name]))] for name in names}
+                for _ in range(num_trials)]
+    else:
+        raise ValueError("Unknown search: {}".format(search))
+
+
+def trial_layer_config(layer_config, parameters):
+    # learning_rate is set on every layer, optimizer on the network, every other parameter on the hidden layers
+    layer_config = [dict(layer) for layer in layer_config]
+    for i in range(1, len(layer_config)):
+        if "learning_rate" in parameters:
+            layer_config[i]["learning_rate"] = parameters["learning_rate"]
+        if i < len(layer_config) - 1:
+            for key, value in parameters.items():
+                if key not in ("learning_rate", "optimizer"):
+                    layer_config[i][key] = value
+    return layer_config
+
+
+def initialize_worker(config_name, dataset_path):
+    # Every worker opens the same memory-mapped dataset, so the pages are shared and nothing is regenerated
+    global config, dataset
+    config = import_module(config_name)
+    inputs, targets = load_dataset(dataset_path)
+    dataset = split_dataset(inputs, 0.15, 0.15), split_dataset(targets, 0.15, 0.15)
+
+
+def train_trial(trial, parameters, state, epochs, seed):
+    # Trains a trial for epochs more epochs, state holds the parameters and optimizer state of the previous rung.
+    # Only the state of the optimizer is passed between the rungs, not the optimizer, which holds the vectors
+    # it is bound to as well.
+    # The pool workers can not start processes of their own, so the trials always train with one worker.
+    (train_inputs, val_inputs, _), (train_targets, val_targets, _) = dataset
+    np.random.seed(seed)
+    layers = get_layers(trial_layer_config(config.layer_config, parameters), dtype=config.dtype,
+                        cache_dtype=config.cache_dtype)
+    nn = NeuralNetwork(
+        layers=layers,
+        loss=get_loss_function(config.loss, dtype=config.dtype),
+        learning_rate=parameters.get("learning_rate", config.learning_rate),
+        optimizer=get_optimizer(parameters.get("optimizer", config.optimizer)),
+        clip_norm=config.clip_norm,
+    )
+    if state is not None:
+        nn.set_parameters(state[0])
+        nn.optimizer.set_state(state[1])
+    losses, validation_losses = nn.fit(
+        inputs=train_inputs,
+        targets=train_targets,
+        validation_inputs=val_inputs,
+        validation_targets=val_targets,
+        epochs=epochs,
+        batch_size=config.batch_size,
+        verbose=False,
+        backprop=config.backprop,
+        k1=config.bptt_k1,
+        k2=config.bptt_k2,
+        shuffle=config.shuffle,
+        seed=seed,
+        pad_last=config.pad_last,
+        log=False,
+        plot_path=None
+    )
+    return trial, (nn.get_parameters(), nn.optimizer.get_state()), losses[-1], validation_losses[-1]
+
+
+def successive_halving(pool, trials, min_epochs, max_epochs, eta, seed=0):
+    # Trains every trial for min_epochs, then keeps the best 1 / eta of them by validation loss and trains those
+    # up to eta times as many epochs, continuing from their parameters, until max_epochs or one trial is left
+    results = [dict(trial=i, **parameters, epochs=0, loss=np.nan, validation_loss=np.nan)
+               for i, parameters in enumerate(trials)]
+    states = [None] * len(trials)
+    running = list(range(len(trials)))
+    trained, epochs, rung = 0, min(min_epochs, max_epochs), 0
+    while True:
+        print("Rung {}, training {} trials to {} epochs".format(rung, len(running), epochs))
+        tasks = [(i, trials[i], states[i], epochs - trained, seed + rung * len(trials) + i) for i in running]
+        for i, state, loss, validation_loss in pool.starmap(train_trial, tasks):
+            states[i] = state
+            results[i].update(epochs=epochs, loss=loss, validation_loss=validation_loss)
+        if epochs >= max_epochs or len(running) == 1:
+            break
+        # Diverged trials have a nan loss and are stopped first
+        running.sort(key=lambda i: np.nan_to_num(results[i]["validation_loss"], nan=np.inf))
+        for i in running[max(1, len(running) // eta):]:
+            states[i] = None
+        running = running[:max(1, len(running) // eta)]
+        trained, epochs, rung = epochs, min(epochs * eta, max_epochs), rung + 1
+    # The trials that survived the most rungs first, then by validation loss
+    return sorted(results, key=lambda result: (-result["epochs"],
+                                               np.nan_to_num(result["validation_loss"], nan=np.inf)))
+
+
+def write_results(path, results):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_results(results, rows=10):
+    names = list(results[0])
+    print(" ".join("{:>15}".format(name) for name in names))
+    for result in results[:rows]:
+        print(" ".join("{:>15.6g}".format(result[name]) if isinstance(result[name], float)
+                       else "{:>15}".format(result[name]) for name in names))
+
+
+if __name__ == '__main__':
+    config_name = "config_files.config" if sweep_config.config_file == 1 else "config_files.config_2"
+    base_config = import_module(config_name)
+    os.makedirs(sweep_config.output_path, exist_ok=True)
+    dataset_path = base_config.dataset_path
+    if dataset_path is None:
+        dataset_path = os.path.join(sweep_config.output_path, "dataset")
+    if not os.path.exists(dataset_path):
+        write_dataset(dataset_path, base_config.dataset_size, base_config.sequence_length, base_config.num_bits,
+                      dtype=base_config.dtype)
+
+    trials = expand_search_space(sweep_config.search_space, sweep_config.search, sweep_config.num_trials,
+                                 sweep_config.seed)
+    with Pool(sweep_config.workers, initializer=initialize_worker, initargs=(config_name, dataset_path)) as pool:
+        results = successive_halving(pool, trials, sweep_config.min_epochs, sweep_config.max_epochs,
+                                     sweep_config.eta, sweep_config.seed)
+    write_results(os.path.join(sweep_config.output_path, "results.csv"), results)
+    print_results(results)
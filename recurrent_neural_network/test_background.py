@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from checkpoint import network_config, build_network
+from data_generator import generate_dataset
+from config_files.config_2 import layer_config, loss, learning_rate, optimizer, num_bits
+
+
+def build():
+    np.random.seed(1)
+    return build_network(network_config(layer_config, loss, learning_rate, optimizer))
+
+
+def test_replica_shares_nothing_and_has_no_optimizer():
+    nn = build()
+    replica = nn.replica()
+    assert replica.optimizer is None
+    assert not np.shares_memory(replica.parameters, nn.parameters)
+    np.testing.assert_array_equal(replica.parameters, nn.parameters)
+    replica.parameters += 1
+    assert replica.layers[1].weights.base is replica.parameters
+    assert not np.array_equal(replica.parameters, nn.parameters)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_background_validation_matches_synchronous(workers):
+    inputs, targets = generate_dataset(300, 8, num_bits)
+    losses = []
+    for background in (False, True):
+        nn = build()
+        losses.append(nn.fit(inputs[:250], targets[:250], inputs[250:], targets[250:], 3, 50, False, log=False,
+                             plot_path=None, workers=workers, background_validation=background))
+    np.testing.assert_allclose(losses[1][0], losses[0][0], rtol=1e-6)
+    np.testing.assert_allclose(losses[1][1], losses[0][1], rtol=1e-6)
+
+
+def test_validation_loss_is_the_loss_of_the_last_timestep():
+    # The validation loss must be the same metric as the training loss and evaluate
+    inputs, targets = generate_dataset(60, 8, num_bits)
+    nn = build()
+    validation_loss = nn.calculate_validation_loss(inputs, targets, batch_size=25)
+    np.testing.assert_allclose(validation_loss, nn.evaluate(inputs, targets)["loss"], rtol=1e-6)
+    batch = np.ascontiguousarray(inputs.transpose(1, 0, 2)), np.ascontiguousarray(targets.transpose(1, 0, 2))
+    np.testing.assert_allclose(validation_loss, nn.compute_grads(*batch), rtol=1e-5)
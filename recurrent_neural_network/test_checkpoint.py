@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from checkpoint import network_config, build_network, save_checkpoint, load_checkpoint, checkpoint_exists
+from data_generator import generate_dataset
+from config_files.config_2 import layer_config, loss, learning_rate, optimizer, num_bits
+
+
+def train(nn, epochs):
+    inputs, targets = generate_dataset(60, 6, num_bits)
+    nn.fit(inputs[:50], targets[:50], inputs[50:], targets[50:], epochs, 10, False, log=False, plot_path=None,
+           initial_epoch=nn.epoch, background_validation=False)
+
+
+def test_saved_checkpoint_replaces_the_old_one(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    config = network_config(layer_config, loss, learning_rate, optimizer)
+    np.random.seed(0)
+    nn = build_network(config)
+    train(nn, 1)
+    save_checkpoint(path, nn, config)
+    mapped, _ = load_checkpoint(path)
+    first_weights = np.array(mapped.parameters)
+
+    train(nn, 2)
+    save_checkpoint(path, nn, config)
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint"]
+    resumed, saved_config = load_checkpoint(path, resume=True)
+    assert saved_config["epoch"] == resumed.epoch == 2
+    np.testing.assert_array_equal(resumed.parameters, nn.parameters)
+    for key, value in nn.optimizer.get_state().items():
+        np.testing.assert_array_equal(resumed.optimizer.get_state()[key], value)
+    # A process that mapped the old weights keeps reading them
+    np.testing.assert_array_equal(mapped.parameters, first_weights)
+
+
+def test_interrupted_save_loads_the_previous_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    config = network_config(layer_config, loss, learning_rate, optimizer)
+    np.random.seed(0)
+    nn = build_network(config)
+    train(nn, 1)
+    save_checkpoint(path, nn, config)
+    # A crash after the old checkpoint was moved aside, the new one is still being written
+    os.rename(path, path + ".old")
+    os.makedirs(path + ".tmp")
+    assert checkpoint_exists(path)
+    resumed, _ = load_checkpoint(path, resume=True)
+    assert resumed.epoch == 1
+    np.testing.assert_array_equal(resumed.parameters, nn.parameters)
+
+    train(nn, 2)
+    save_checkpoint(path, nn, config)
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint"]
+    assert load_checkpoint(path, resume=True)[0].epoch == 2
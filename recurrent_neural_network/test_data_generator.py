@@ -0,0 +1,29 @@
+import threading
+import time
+
+import numpy as np
+
+from data_generator import batch_iterator, generate_dataset
+
+
+def test_prefetched_batches_match():
+    inputs, targets = generate_dataset(95, 6, 4)
+    expected = list(batch_iterator(10, inputs, targets, pad_last=True))
+    prefetched = list(batch_iterator(10, inputs, targets, pad_last=True, prefetch=2))
+    assert len(prefetched) == len(expected) == 10
+    for a, b in zip(prefetched, expected):
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
+
+
+def test_closed_prefetch_stops_its_thread():
+    inputs, targets = generate_dataset(200, 6, 4)
+    threads = threading.active_count()
+    for _ in range(5):
+        batches = batch_iterator(10, inputs, targets, prefetch=2)
+        next(batches)
+        batches.close()
+    deadline = time.monotonic() + 5
+    while threading.active_count() > threads and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == threads
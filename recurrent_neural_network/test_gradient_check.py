@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from config_parser import get_layers
+from loss import MSE
+from neural_network import NeuralNetwork
+
+
+def sequence_loss(nn, inputs, targets):
+    # Sum of squared errors over every timestep, the objective whose gradient is MSE.grad.
+    # Uses the per-step forward pass, so the check also covers forward_sequence against it.
+    nn.reset_cache()
+    loss = 0.0
+    for t in range(len(inputs)):
+        loss += np.sum((nn.forward(inputs[t]) - targets[t]) ** 2)
+    nn.reset_cache()
+    return loss
+
+
+def analytical_gradients(nn, inputs, targets, backprop="bptt"):
+    nn.reset_cache()
+    nn.compute_grads(inputs, targets, backprop=backprop)
+    gradients = [{key: layer.grads[key].copy() for key in layer.grads} for layer in nn.layers]
+    nn.reset_cache()
+    return gradients
+
+
+def numerical_gradient(nn, parameter, inputs, targets, epsilon):
+    grad = np.zeros_like(parameter)
+    for index in np.ndindex(parameter.shape):
+        original = parameter[index]
+        parameter[index] = original + epsilon
+        loss_plus = sequence_loss(nn, inputs, targets)
+        parameter[index] = original - epsilon
+        loss_minus = sequence_loss(nn, inputs, targets)
+        parameter[index] = original
+        grad[index] = (loss_plus - loss_minus) / (2 * epsilon)
+    return grad
+
+
+def relative_error(a, b):
+    return np.max(np.abs(a - b) / np.maximum(1e-8, np.abs(a) + np.abs(b)))
+
+
+def build(layer_config, sequence_length=5, batch_size=3, seed=0):
+    np.random.seed(seed)
+    nn = NeuralNetwork(layers=get_layers(layer_config, dtype="float64"), loss=MSE("float64"), learning_rate=0)
+    inputs = np.random.uniform(-1, 1, size=(sequence_length, batch_size, layer_config[0]["size"]))
+    targets = np.random.uniform(-1, 1, size=(sequence_length, batch_size, layer_config[-1]["size"]))
+    return nn, inputs, targets
+
+
+def gradient_check(layer_config, backprop="bptt", epsilon=1e-5):
+    nn, inputs, targets = build(layer_config)
+    gradients = analytical_gradients(nn, inputs, targets, backprop)
+    errors = {}
+    for i, layer in enumerate(nn.layers):
+        for key in ("weights", "internal_weights", "bias"):
+            if key not in gradients[i]:
+                continue
+            numerical = numerical_gradient(nn, getattr(layer, key), inputs, targets, epsilon)
+            errors["{}-{} {}".format(i, layer.name, key)] = relative_error(gradients[i][key], numerical)
+    return errors
+
+
+tolerance = 1e-4
+layer_config = [
+    {'type': 'input', 'size': 4},
+    {'type': 'recurrent', 'size': 6, 'activation': 'tanh', 'weight_range': (-0.5, 0.5)},
+    {'type': 'recurrent', 'size': 5, 'activation': 'sigmoid', 'weight_range': (-0.5, 0.5)},
+    {'type': 'lstm', 'size': 5, 'weight_range': (-0.5, 0.5)},
+    {'type': 'gru', 'size': 5, 'weight_range': (-0.5, 0.5)},
+    {'type': 'dense', 'size': 4, 'activation': 'tanh', 'weight_range': (-0.5, 0.5)},
+]
+
+
+@pytest.mark.parametrize("backprop", ["bptt", "step"])
+def test_gradients_match_finite_differences(backprop):
+    errors = gradient_check(layer_config, backprop)
+    failed = {name: error for name, error in errors.items() if error > tolerance}
+    assert not failed, failed
+
+
+def test_step_gradients_match_bptt():
+    nn, inputs, targets = build(layer_config)
+    step = analytical_gradients(nn, inputs, targets, "step")
+    bptt = analytical_gradients(nn, inputs, targets, "bptt")
+    for step_grads, bptt_grads in zip(step, bptt):
+        for key in step_grads:
+            np.testing.assert_allclose(step_grads[key], bptt_grads[key], rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize("k1, k2", [(0, None), (-1, 2), (1.5, None), (2, 1), (2, 0)])
+def test_truncated_windows_must_advance(k1, k2):
+    nn, inputs, targets = build(layer_config)
+    with pytest.raises(ValueError):
+        nn.backward_truncated(inputs, targets, k1, k1 if k2 is None else k2)
+    with pytest.raises(ValueError):
+        nn.fit(inputs.transpose(1, 0, 2), targets.transpose(1, 0, 2), inputs.transpose(1, 0, 2),
+               targets.transpose(1, 0, 2), 1, 3, False, backprop="tbptt", k1=k1, k2=k2, log=False, plot_path=None)
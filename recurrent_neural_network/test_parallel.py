@@ -0,0 +1,95 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from callbacks import Callback
+from checkpoint import network_config, build_network
+from data_generator import generate_dataset
+from parallel import DataParallel
+from config_files.config_2 import layer_config, loss, learning_rate, optimizer, num_bits
+
+
+@pytest.mark.parametrize("backprop", ["step", "bptt"])
+def test_parallel_gradients_match_serial(backprop):
+    # The gradients of the shards must add up to the gradient of the whole batch
+    inputs, targets = generate_dataset(32, 10, num_bits, dtype="float64")
+    inputs, targets = np.ascontiguousarray(inputs.transpose(1, 0, 2)), np.ascontiguousarray(targets.transpose(1, 0, 2))
+    np.random.seed(0)
+    nn = build_network(network_config(layer_config, loss, learning_rate, optimizer, dtype="float64"))
+    nn.compute_grads(inputs, targets, backprop=backprop)
+    serial = nn.grads.copy()
+    nn.reset_cache()
+
+    parallel = DataParallel(nn, 3)
+    try:
+        parallel.compute_grads(inputs, targets, backprop=backprop)
+        np.testing.assert_allclose(nn.grads, serial, rtol=1e-10, atol=1e-12)
+    finally:
+        parallel.close()
+
+
+def test_padded_rows_are_left_out_of_the_loss():
+    # A batch padded with garbage rows must have the loss and the gradients of its real rows alone
+    inputs, targets = generate_dataset(32, 10, num_bits, dtype="float64")
+    inputs, targets = np.ascontiguousarray(inputs.transpose(1, 0, 2)), np.ascontiguousarray(targets.transpose(1, 0, 2))
+    mask = np.zeros(32, dtype=bool)
+    mask[:20] = True
+    np.random.seed(0)
+    nn = build_network(network_config(layer_config, loss, learning_rate, optimizer, dtype="float64"))
+    real_loss = nn.compute_grads(inputs[:, :20], targets[:, :20])
+    real_grads = nn.grads.copy()
+    nn.reset_cache()
+
+    padded_inputs, padded_targets = inputs.copy(), targets.copy()
+    padded_inputs[:, 20:] = 1
+    padded_targets[:, 20:] = 0
+    padded_loss = nn.compute_grads(padded_inputs, padded_targets, mask)
+    np.testing.assert_allclose(padded_loss, real_loss, rtol=1e-12)
+    np.testing.assert_allclose(nn.grads, real_grads, rtol=1e-10, atol=1e-12)
+    nn.reset_cache()
+
+    # With 4 workers the last shard is only padding
+    parallel = DataParallel(nn, 4)
+    try:
+        parallel_loss = parallel.compute_grads(padded_inputs, padded_targets, mask)
+        np.testing.assert_allclose(parallel_loss, real_loss, rtol=1e-12)
+        np.testing.assert_allclose(nn.grads, real_grads, rtol=1e-10, atol=1e-12)
+    finally:
+        parallel.close()
+
+
+class FailingCallback(Callback):
+
+    def on_batch_end(self, network, batch, logs):
+        if batch == 1:
+            raise RuntimeError("callback failed")
+
+
+def test_failed_fit_releases_the_shared_memory():
+    inputs, targets = generate_dataset(200, 8, num_bits)
+    np.random.seed(0)
+    nn = build_network(network_config(layer_config, loss, learning_rate, optimizer))
+    shared_memory = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    with pytest.raises(RuntimeError, match="callback failed"):
+        nn.fit(inputs[:150], targets[:150], inputs[150:], targets[150:], 2, 25, False, log=False, plot_path=None,
+               workers=2, callbacks=[FailingCallback()])
+    assert nn.parameters.flags.owndata
+    assert nn.layers[1].weights.base is nn.parameters
+    if os.path.isdir("/dev/shm"):
+        assert set(os.listdir("/dev/shm")) <= shared_memory
+
+
+def test_workers_do_not_trace_memory():
+    np.random.seed(0)
+    nn = build_network(network_config(layer_config, loss, learning_rate, optimizer))
+    tracemalloc.start()
+    try:
+        parallel = DataParallel(nn, 2)
+    finally:
+        tracemalloc.stop()
+    try:
+        assert not any(parallel.pool.starmap(tracemalloc.is_tracing, [()] * 4))
+    finally:
+        parallel.close()
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+import numpy as np
+
+from checkpoint import network_config, build_network
+from config_files.config_2 import layer_config, loss, learning_rate, optimizer, num_bits
+from server import StreamingServer
+
+
+async def exchange(lines):
+    np.random.seed(0)
+    server = StreamingServer(build_network(network_config(layer_config, loss, learning_rate, optimizer)))
+    socket_server = await server.start("127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*socket_server.sockets[0].getsockname()[:2])
+        responses = []
+        for line in lines:
+            writer.write(line.encode() + b"\n")
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        # Lets the server see the connection close before the event loop stops
+        await asyncio.sleep(0.01)
+        return responses
+    finally:
+        server.close()
+        socket_server.close()
+        await socket_server.wait_closed()
+
+
+def test_malformed_requests_are_answered_with_errors():
+    responses = asyncio.run(exchange([
+        "not json",
+        "[1, 2]",
+        json.dumps({"input": [0] * num_bits}),
+        json.dumps({"session": ["a"], "input": [0] * num_bits}),
+        json.dumps({"session": "a"}),
+        json.dumps({"session": "a", "input": [0, 1]}),
+        json.dumps({"session": "a", "input": [None] * num_bits}),
+        json.dumps({"session": "a", "input": [0] * num_bits}),
+    ]))
+    for response in responses[:4]:
+        assert set(response) == {"error"}
+    for response in responses[4:7]:
+        assert response["session"] == "a" and "error" in response
+    # The connection is still open after the errors
+    assert len(responses[7]["prediction"]) == num_bits